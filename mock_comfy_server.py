@@ -0,0 +1,611 @@
+"""
+Stand-in ComfyUI server for exercising the client stack without a GPU.
+
+Implements /prompt, /queue, /history, /view, /interrupt and /ws with the
+standard library only. Queued prompts run one at a time: every node gets an
+"executing" message, sampler nodes report "progress" steps and send binary
+preview frames, and image output nodes produce PNGs that are served from
+/view (with Range support) or, for SaveImageWebsocket nodes, sent as binary
+frames. Step timing, image size, HTTP latency and failure injection are
+configurable.
+
+    python mock_comfy_server.py --port 8188 --steps 20 --step-time 0.05
+
+Then point the app or ComfyUIClient at http://127.0.0.1:8188.
+"""
+
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import random
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_OP_TEXT, _OP_BINARY, _OP_CLOSE, _OP_PING, _OP_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+PREVIEW_IMAGE = 1  # Binary frame event type
+PNG_FORMAT = 2  # Binary frame image format
+SAMPLER_CLASSES = ("KSampler", "KSamplerAdvanced", "FaceDetailer")
+IMAGE_OUTPUT_CLASSES = ("PreviewImage", "SaveImage")
+WEBSOCKET_OUTPUT_CLASS = "SaveImageWebsocket"
+PREVIEW_SIZE = 64
+
+
+class MockConfig:
+    """Timing, payload and failure-injection settings of the mock server."""
+
+    def __init__(
+        self,
+        steps=20,
+        step_time=0.05,
+        node_time=0.005,
+        image_size=None,
+        preview_every=1,
+        latency=0.0,
+        failure_rate=0.0,
+        http_error_rate=0.0,
+        disconnect_rate=0.0,
+        seed=None,
+    ):
+        self.steps = steps  # Progress steps per sampler node
+        self.step_time = step_time  # Seconds per sampler step
+        self.node_time = node_time  # Seconds per other node
+        # (width, height) of output images; None uses the EmptyLatentImage size
+        self.image_size = image_size
+        self.preview_every = preview_every  # Steps between preview frames; 0 = off
+        self.latency = latency  # Seconds added before every HTTP response
+        self.failure_rate = failure_rate  # Chance a prompt ends in execution_error
+        self.http_error_rate = http_error_rate  # Chance of a 500 per HTTP request
+        self.disconnect_rate = disconnect_rate  # Chance per step to drop the WS
+        self.random = random.Random(seed)
+
+
+def make_png(width, height, rng=None):
+    """
+    Encodes a noise image as an RGB PNG. Noise barely compresses, so the file
+    is about width * height * 3 bytes, like a detailed generation.
+    """
+    rng = rng or random.Random()
+    row_size = width * 3
+    noise = rng.randbytes(row_size * height)
+    raw = b"".join(
+        b"\0" + noise[y * row_size : (y + 1) * row_size] for y in range(height)
+    )
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw, 1))
+        + chunk(b"IEND", b"")
+    )
+
+
+class WebSocket:
+    """Minimal RFC 6455 server endpoint on top of an HTTP handler's socket."""
+
+    def __init__(self, handler):
+        self._rfile = handler.rfile
+        self._wfile = handler.wfile
+        self._socket = handler.connection
+        self._send_lock = threading.Lock()
+        self.open = True
+
+    def send_text(self, text):
+        self._send(_OP_TEXT, text.encode("utf-8"))
+
+    def send_json(self, message):
+        self.send_text(json.dumps(message))
+
+    def send_binary(self, data):
+        self._send(_OP_BINARY, data)
+
+    def _send(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        with self._send_lock:
+            if not self.open:
+                return
+            try:
+                self._wfile.write(header)
+                self._wfile.write(payload)
+                self._wfile.flush()
+            except OSError:
+                self.open = False
+
+    def _read_exact(self, n):
+        data = self._rfile.read(n)
+        if len(data) < n:
+            raise ConnectionError("WebSocket closed by peer")
+        return data
+
+    def serve(self):
+        """Reads client frames until the connection closes, answering pings."""
+        try:
+            while self.open:
+                first, second = self._read_exact(2)
+                opcode = first & 0x0F
+                length = second & 0x7F
+                if length == 126:
+                    length = struct.unpack(">H", self._read_exact(2))[0]
+                elif length == 127:
+                    length = struct.unpack(">Q", self._read_exact(8))[0]
+                mask = self._read_exact(4) if second & 0x80 else None
+                payload = self._read_exact(length)
+                if mask:
+                    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+                if opcode == _OP_CLOSE:
+                    self._send(_OP_CLOSE, payload[:2])
+                    break
+                if opcode == _OP_PING:
+                    self._send(_OP_PONG, payload)
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            self.open = False
+
+    def drop(self):
+        """Cuts the TCP connection without a close frame, like a network loss."""
+        self.open = False
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class MockComfyServer:
+    """
+    In-process mock of the ComfyUI HTTP and WebSocket API.
+
+    start() serves on a background thread and returns the base URL, so
+    benchmarks and stress scripts can create one per run.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8188, config=None):
+        self.config = config or MockConfig()
+        self._lock = threading.Condition()
+        self._pending = deque()
+        self._running = None
+        self._history = {}
+        self._images = {}  # filename -> PNG bytes
+        self._sockets = {}  # client_id -> list of WebSocket
+        self._numbers = itertools.count()
+        self._interrupted = False
+        self._stopped = False
+        self._png_cache = {}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._threads = []
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        for target in (self._httpd.serve_forever, self._run_worker):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self.url
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        for sockets in list(self._sockets.values()):
+            for ws in list(sockets):
+                ws.drop()
+
+    # --- WebSocket fan-out ---
+
+    def _send(self, client_id, message):
+        for ws in list(self._sockets.get(client_id, ())):
+            if isinstance(message, bytes):
+                ws.send_binary(message)
+            else:
+                ws.send_json(message)
+
+    def _status_message(self):
+        remaining = len(self._pending) + (1 if self._running else 0)
+        return {
+            "type": "status",
+            "data": {"status": {"exec_info": {"queue_remaining": remaining}}},
+        }
+
+    def _broadcast_status(self):
+        message = self._status_message()
+        for client_id in list(self._sockets):
+            self._send(client_id, message)
+
+    # --- Prompt execution ---
+
+    def queue_prompt(self, prompt, client_id):
+        prompt_id = str(uuid.uuid4())
+        with self._lock:
+            number = next(self._numbers)
+            self._pending.append((number, prompt_id, prompt, client_id))
+            self._lock.notify_all()
+        self._broadcast_status()
+        return prompt_id, number
+
+    def interrupt(self):
+        with self._lock:
+            if self._running:
+                self._interrupted = True
+
+    def _run_worker(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._stopped:
+                    self._lock.wait()
+                if self._stopped:
+                    return
+                self._running = self._pending.popleft()
+                self._interrupted = False
+            number, prompt_id, prompt, client_id = self._running
+            try:
+                status, outputs = self._execute(prompt_id, prompt, client_id)
+            except Exception as e:
+                status = self._error_status(prompt_id, "execution_error", str(e))
+                outputs = {}
+            with self._lock:
+                self._history[prompt_id] = {
+                    "prompt": [number, prompt_id, prompt, {"client_id": client_id}],
+                    "outputs": outputs,
+                    "status": status,
+                }
+                self._running = None
+            self._broadcast_status()
+
+    @staticmethod
+    def _error_status(prompt_id, kind, message):
+        data = {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}
+        if kind == "execution_error":
+            data["exception_message"] = message
+        return {
+            "status_str": "error",
+            "completed": False,
+            "messages": [["execution_start", data], [kind, data]],
+        }
+
+    def _output_size(self, prompt):
+        """Returns (width, height, batch_size) of the prompt's output images."""
+        width, height, batch_size = 512, 512, 1
+        for node in prompt.values():
+            inputs = node.get("inputs", {})
+            if node.get("class_type") == "EmptyLatentImage":
+                width = int(inputs.get("width", width))
+                height = int(inputs.get("height", height))
+                batch_size = int(inputs.get("batch_size", batch_size))
+                break
+        if self.config.image_size:
+            width, height = self.config.image_size
+        return width, height, batch_size
+
+    def _png(self, width, height):
+        key = (width, height)
+        if key not in self._png_cache:
+            self._png_cache[key] = make_png(width, height, self.config.random)
+        return self._png_cache[key]
+
+    def _maybe_drop(self, client_id):
+        if self.config.random.random() < self.config.disconnect_rate:
+            for ws in list(self._sockets.get(client_id, ())):
+                ws.drop()
+
+    def _execute(self, prompt_id, prompt, client_id):
+        config = self.config
+        started = {"prompt_id": prompt_id, "timestamp": int(time.time() * 1000)}
+        self._send(client_id, {"type": "execution_start", "data": started})
+        fail_at = None
+        if config.random.random() < config.failure_rate:
+            fail_at = config.random.choice(list(prompt))
+        outputs = {}
+        width, height, batch_size = self._output_size(prompt)
+        for node_id in sorted(prompt, key=lambda k: (len(k), k)):
+            class_type = prompt[node_id].get("class_type")
+            self._send(
+                client_id,
+                {
+                    "type": "executing",
+                    "data": {
+                        "node": node_id,
+                        "display_node": node_id,
+                        "prompt_id": prompt_id,
+                    },
+                },
+            )
+            if node_id == fail_at:
+                message = f"Injected failure in node {node_id} ({class_type})"
+                data = {
+                    "prompt_id": prompt_id,
+                    "node_id": node_id,
+                    "node_type": class_type,
+                    "exception_message": message,
+                }
+                self._send(client_id, {"type": "execution_error", "data": data})
+                return self._error_status(prompt_id, "execution_error", message), {}
+
+            if class_type in SAMPLER_CLASSES:
+                for step in range(1, config.steps + 1):
+                    time.sleep(config.step_time)
+                    if self._interrupted:
+                        data = {"prompt_id": prompt_id, "node_id": node_id}
+                        self._send(
+                            client_id, {"type": "execution_interrupted", "data": data}
+                        )
+                        status = self._error_status(
+                            prompt_id, "execution_interrupted", ""
+                        )
+                        return status, {}
+                    self._maybe_drop(client_id)
+                    progress = {
+                        "value": step,
+                        "max": config.steps,
+                        "prompt_id": prompt_id,
+                        "node": node_id,
+                    }
+                    self._send(client_id, {"type": "progress", "data": progress})
+                    if config.preview_every and step % config.preview_every == 0:
+                        header = struct.pack(">II", PREVIEW_IMAGE, PNG_FORMAT)
+                        self._send(
+                            client_id, header + self._png(PREVIEW_SIZE, PREVIEW_SIZE)
+                        )
+            else:
+                time.sleep(config.node_time)
+
+            if class_type in IMAGE_OUTPUT_CLASSES:
+                folder_type = "output" if class_type == "SaveImage" else "temp"
+                images = []
+                for index in range(batch_size):
+                    filename = f"ComfyUI_mock_{prompt_id[:8]}_{node_id}_{index:05}.png"
+                    with self._lock:
+                        self._images[filename] = self._png(width, height)
+                    images.append(
+                        {"filename": filename, "subfolder": "", "type": folder_type}
+                    )
+                output = {"images": images}
+                outputs[node_id] = output
+                data = {
+                    "node": node_id,
+                    "display_node": node_id,
+                    "output": output,
+                    "prompt_id": prompt_id,
+                }
+                self._send(client_id, {"type": "executed", "data": data})
+            elif class_type == WEBSOCKET_OUTPUT_CLASS:
+                header = struct.pack(">II", PREVIEW_IMAGE, PNG_FORMAT)
+                for _ in range(batch_size):
+                    self._send(client_id, header + self._png(width, height))
+
+        self._send(
+            client_id,
+            {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}},
+        )
+        self._send(client_id, {"type": "execution_success", "data": started})
+        status = {"status_str": "success", "completed": True, "messages": []}
+        return status, outputs
+
+    # --- HTTP ---
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like aiohttp
+
+            def log_message(self, format, *args):
+                pass
+
+            def _inject(self):
+                config = server.config
+                if config.latency:
+                    time.sleep(config.latency)
+                if config.random.random() < config.http_error_rate:
+                    self._send_json({"error": "Injected failure"}, 500)
+                    return True
+                return False
+
+            def _send_bytes(self, body, content_type, status=200, headers=()):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, payload, status=200):
+                body = json.dumps(payload).encode("utf-8")
+                self._send_bytes(body, "application/json", status)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/ws":
+                    return self._websocket(parse_qs(url.query))
+                if self._inject():
+                    return
+                if url.path == "/queue":
+                    with server._lock:
+                        running = [server._running] if server._running else []
+                        pending = list(server._pending)
+                    # [number, prompt_id, prompt, extra_data, outputs_to_execute]
+                    running, pending = (
+                        [
+                            [n, p, prompt, {"client_id": c}, []]
+                            for n, p, prompt, c in items
+                        ]
+                        for items in (running, pending)
+                    )
+                    return self._send_json(
+                        {"queue_running": running, "queue_pending": pending}
+                    )
+                if url.path == "/history":
+                    with server._lock:
+                        return self._send_json(dict(server._history))
+                if url.path.startswith("/history/"):
+                    prompt_id = url.path[len("/history/") :]
+                    with server._lock:
+                        entry = server._history.get(prompt_id)
+                    return self._send_json({prompt_id: entry} if entry else {})
+                if url.path == "/view":
+                    return self._view(parse_qs(url.query))
+                self._send_json({"error": "Not found"}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if self._inject():
+                    return
+                url = urlparse(self.path)
+                if url.path == "/prompt":
+                    try:
+                        payload = json.loads(body or b"{}")
+                        prompt = payload["prompt"]
+                    except (ValueError, KeyError):
+                        return self._send_json({"error": "Invalid prompt"}, 400)
+                    prompt_id, number = server.queue_prompt(
+                        prompt, payload.get("client_id")
+                    )
+                    return self._send_json(
+                        {"prompt_id": prompt_id, "number": number, "node_errors": {}}
+                    )
+                if url.path == "/queue":
+                    try:
+                        payload = json.loads(body or b"{}")
+                    except ValueError:
+                        return self._send_json({"error": "Invalid request"}, 400)
+                    with server._lock:
+                        if payload.get("clear"):
+                            server._pending.clear()
+                        delete = set(payload.get("delete", ()))
+                        server._pending = deque(
+                            item for item in server._pending if item[1] not in delete
+                        )
+                    server._broadcast_status()
+                    return self._send_bytes(b"", "text/plain")
+                if url.path == "/interrupt":
+                    server.interrupt()
+                    return self._send_bytes(b"", "text/plain")
+                self._send_json({"error": "Not found"}, 404)
+
+            def _view(self, query):
+                filename = query.get("filename", [""])[0]
+                with server._lock:
+                    image = server._images.get(filename)
+                if image is None:
+                    return self._send_json({"error": "Not found"}, 404)
+                start = 0
+                byte_range = self.headers.get("Range", "")
+                if byte_range.startswith("bytes="):
+                    start = int(byte_range[len("bytes=") :].split("-")[0] or 0)
+                    end = len(image) - 1
+                    headers = [("Content-Range", f"bytes {start}-{end}/{len(image)}")]
+                    return self._send_bytes(image[start:], "image/png", 206, headers)
+                self._send_bytes(image, "image/png")
+
+            def _websocket(self, query):
+                key = self.headers.get("Sec-WebSocket-Key")
+                if not key:
+                    return self._send_json({"error": "Expected WebSocket"}, 400)
+                accept = hashlib.sha1((key + _WS_GUID).encode("ascii")).digest()
+                self.send_response(101)
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header(
+                    "Sec-WebSocket-Accept", base64.b64encode(accept).decode()
+                )
+                self.end_headers()
+                self.wfile.flush()
+
+                client_id = query.get("clientId", [uuid.uuid4().hex])[0]
+                ws = WebSocket(self)
+                with server._lock:
+                    server._sockets.setdefault(client_id, []).append(ws)
+                    status = server._status_message()
+                status["data"]["sid"] = client_id
+                ws.send_json(status)
+                try:
+                    ws.serve()
+                finally:
+                    with server._lock:
+                        server._sockets[client_id].remove(ws)
+                        if not server._sockets[client_id]:
+                            del server._sockets[client_id]
+                    self.close_connection = True
+
+        return Handler
+
+
+def _parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--steps", type=int, default=20, help="Sampler steps")
+    parser.add_argument(
+        "--step-time", type=float, default=0.05, help="Seconds per step"
+    )
+    parser.add_argument(
+        "--image-size", type=_parse_size, help="Output WxH (default: latent size)"
+    )
+    parser.add_argument(
+        "--preview-every", type=int, default=1, help="Steps per preview; 0 disables"
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="HTTP delay (s)")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--http-error-rate", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, help="Seed for failure injection")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        steps=args.steps,
+        step_time=args.step_time,
+        image_size=args.image_size,
+        preview_every=args.preview_every,
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        http_error_rate=args.http_error_rate,
+        disconnect_rate=args.disconnect_rate,
+        seed=args.seed,
+    )
+    server = MockComfyServer(args.host, args.port, config)
+    url = server.start()
+    print(f"Mock ComfyUI server listening on {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\nStopping mock server.")
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
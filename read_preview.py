@@ -1,8 +1,6 @@
 import json
 import os
 import io
-import struct
-import requests
 from PIL import Image
 from src.services.client import ComfyUIClient
 
@@ -12,20 +10,6 @@ WORKFLOW_FILE = "json/GGUF_WORKFLOW_API.json"
 OUTPUT_DIR = "previews"
 
 
-def get_image(filename, subfolder, folder_type, api_url):
-    """
-    Downloads an image from the ComfyUI server.
-    """
-    try:
-        image_url = f"{api_url}/view?filename={filename}&subfolder={subfolder}&type={folder_type}"
-        img_response = requests.get(image_url)
-        img_response.raise_for_status()
-        return img_response.content
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching image {filename}: {e}")
-        return None
-
-
 def main():
     """
     Connects to ComfyUI, runs a workflow, and saves preview and final images.
@@ -43,6 +27,8 @@ def main():
         print("Connection failed.")
         return
     print("Successfully connected.")
+    # Start keeping messages before queuing so none of the prompt's are missed
+    client.listen_all()
 
     # --- 3. Queue Workflow ---
     try:
@@ -72,22 +58,19 @@ def main():
             if msg is None:
                 continue
 
-            if isinstance(msg, bytes):
-                # --- Handle Binary Preview Image ---
-                if len(msg) > 8:
-                    header = msg[:8]
-                    event_type, node_id = struct.unpack("!II", header)
-                    if event_type == 1:  # Preview image
-                        print(f"Received a preview image from node {node_id}.")
-                        try:
-                            image = Image.open(io.BytesIO(msg[8:]))
-                            count = preview_counts.get(node_id, 0)
-                            filename = f"preview_node_{node_id}_{count}.png"
-                            image.save(os.path.join(OUTPUT_DIR, filename))
-                            print(f"Saved preview: {filename}")
-                            preview_counts[node_id] = count + 1
-                        except Exception as e:
-                            print(f"Error processing preview: {e}")
+            if not isinstance(msg, dict):
+                # --- Handle Binary Preview Image (a decoded BinaryFrame) ---
+                node_id = msg.node_id or "unknown"
+                print(f"Received a {msg.image_type} preview from node {node_id}.")
+                try:
+                    image = Image.open(io.BytesIO(msg.data))
+                    count = preview_counts.get(node_id, 0)
+                    filename = f"preview_node_{node_id}_{count}.png"
+                    image.save(os.path.join(OUTPUT_DIR, filename))
+                    print(f"Saved preview: {filename}")
+                    preview_counts[node_id] = count + 1
+                except Exception as e:
+                    print(f"Error processing preview: {e}")
                 continue
 
             # --- Handle Text (JSON) Messages ---
@@ -102,11 +85,10 @@ def main():
                             print("Received final image data.")
                             images_output = data["output"]["images"]
                             for image_info in images_output:
-                                image_data = get_image(
+                                image_data = client.get_image(
                                     image_info["filename"],
                                     image_info["subfolder"],
                                     image_info["type"],
-                                    client.api_url,
                                 )
                                 if image_data:
                                     try:
@@ -131,7 +113,7 @@ def main():
         print("\nInterrupted by user.")
         client.interrupt_generation()
     finally:
-        client.close_ws_connection()
+        client.close()
         print("WebSocket connection closed.")
 
 
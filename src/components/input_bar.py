@@ -1,18 +1,43 @@
 # src/components/input_bar.py
+import threading
 import flet as ft
 from utils.logger import get_logger
-from utils.data import ALL_PROMPTS
+from services.suggestion_service import SuggestionService
 
 logger = get_logger(__name__)
 
+# Number of suggestion rows; rows are created once and reused
+SUGGESTION_POOL_SIZE = 10
+# Seconds without typing before a changed prompt is passed to on_change
+SAVE_DELAY = 1.0
+
 
 class InputBar(ft.Container):
-    def __init__(self, on_send, on_cancel, on_settings_click, on_change=None):
+    def __init__(
+        self,
+        on_send,
+        on_cancel,
+        on_settings_click,
+        on_change=None,
+        suggestion_categories=None,
+    ):
         super().__init__()
         self.on_send = on_send
         self.on_cancel = on_cancel
         self.on_settings_click = on_settings_click
         self.on_change = on_change
+        self.suggestion_service = SuggestionService(
+            on_result=self._on_suggestions,
+            limit=SUGGESTION_POOL_SIZE,
+            # e.g. ("artist", "character"), or everything but "meta"
+            categories=suggestion_categories,
+        )
+        # Set when the list is dismissed; cleared by the next keystroke
+        self._suggestions_dismissed = False
+        # on_change runs once typing settles, and only for new text
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._saved_text = None
         logger.info("InputBar initialized.")
 
         # --- Controls ---
@@ -30,7 +55,18 @@ class InputBar(ft.Container):
             on_change=self._on_text_change,
         )
 
-        self.suggestion_list = ft.ListView(spacing=0, padding=0)
+        self.suggestion_rows = [
+            ft.ListTile(
+                title=ft.Text("", color=ft.colors.WHITE),
+                data=None,
+                visible=False,
+                on_click=self._use_suggestion,
+            )
+            for _ in range(SUGGESTION_POOL_SIZE)
+        ]
+        self.suggestion_list = ft.ListView(
+            controls=self.suggestion_rows, spacing=0, padding=0
+        )
         self.suggestion_container = ft.Container(
             content=self.suggestion_list,
             bgcolor=ft.colors.GREY_900,
@@ -105,47 +141,75 @@ class InputBar(ft.Container):
         """Sets the prompt field's value."""
         logger.debug(f"Setting prompt to: '{value}'")
         self.prompt_field.value = value
+        self._saved_text = value  # Loaded from the config; nothing to save
         self.update()
 
     def _on_text_change(self, e):
-        if self.on_change:
-            self.on_change()
         typed_text = e.control.value
         logger.debug(f"Text changed: '{typed_text}'")
-        if not typed_text.strip():
-            self.hide_suggestions()
+        self._suggestions_dismissed = False
+        # Saving and searching happen once typing pauses, off the event handler
+        self._schedule_save()
+        self.suggestion_service.submit(typed_text)
+
+    def _schedule_save(self):
+        """(Re)starts the timer that passes the settled prompt to on_change."""
+        if not self.on_change:
             return
+        with self._save_lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+            self._save_timer = threading.Timer(SAVE_DELAY, self._save_if_changed)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _save_if_changed(self):
+        text = self.prompt_field.value
+        with self._save_lock:
+            self._save_timer = None
+            if text == self._saved_text:
+                return
+            self._saved_text = text
+        try:
+            self.on_change()
+        except Exception as e:
+            logger.error(f"Saving the prompt failed: {e}", exc_info=True)
 
-        parts = typed_text.split(",")
-        current_word = parts[-1].strip().lower()
-
-        if not current_word:
-            self.hide_suggestions()
+    def _on_suggestions(self, typed_text: str, matches: list[str]):
+        if self._suggestions_dismissed:
             return
-
-        matches = [p for p in ALL_PROMPTS if p.lower().startswith(current_word)]
-
         if not matches:
-            self.hide_suggestions()
+            self._hide_suggestion_container()
             return
 
-        self._update_suggestions(matches[:10])
+        self._update_suggestions(matches)
 
     def _update_suggestions(self, matches):
         logger.debug(f"Updating suggestions with {len(matches)} matches.")
-        self.suggestion_list.controls = [
-            ft.ListTile(
-                title=ft.Text(m, color=ft.colors.WHITE),
-                data=m,
-                on_click=self._use_suggestion,
-            )
-            for m in matches
-        ]
-
-        self.suggestion_container.height = min(len(matches) * 50, 200)
-        self.suggestion_container.opacity = 1
-        self.suggestion_container.update()
-        self.suggestion_list.update()
+        matches = matches[:SUGGESTION_POOL_SIZE]
+        # Only rows whose text or visibility changed are sent to the client
+        changed = []
+        for i, row in enumerate(self.suggestion_rows):
+            match = matches[i] if i < len(matches) else None
+            if row.data == match:
+                continue
+            row.data = match
+            row.visible = match is not None
+            if match is not None:
+                row.title.value = match
+            changed.append(row)
+
+        height = min(len(matches) * 50, 200)
+        if (
+            self.suggestion_container.height != height
+            or self.suggestion_container.opacity != 1
+        ):
+            self.suggestion_container.height = height
+            self.suggestion_container.opacity = 1
+            changed.append(self.suggestion_container)
+
+        if changed and self.page:
+            self.page.update(*changed)
 
     def _use_suggestion(self, e):
         suggestion = e.control.data
@@ -158,14 +222,31 @@ class InputBar(ft.Container):
 
         self.prompt_field.value = ",".join(parts) + ", "
         self.prompt_field.update()
+        self._schedule_save()
         self.hide_suggestions()
 
     def hide_suggestions(self):
         logger.debug("Hiding suggestions.")
+        # Keep a pending lookup from reopening the list
+        self._suggestions_dismissed = True
+        self._hide_suggestion_container()
+
+    def _hide_suggestion_container(self):
+        if self.suggestion_container.opacity == 0:
+            return
         self.suggestion_container.height = 0
         self.suggestion_container.opacity = 0
         self.suggestion_container.update()
 
+    def close(self):
+        """Saves a prompt still waiting for its timer and stops the workers."""
+        with self._save_lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+            self._save_if_changed()
+        self.suggestion_service.close()
+
     def toggle_read_only(self, is_readonly):
         logger.debug(f"Toggling read-only to: {is_readonly}")
         self.prompt_field.read_only = is_readonly
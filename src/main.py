@@ -2,12 +2,15 @@
 import flet as ft
 from view import HomeView
 from utils.logger import get_logger
+from utils.data import TAG_LOADER
 
 logger = get_logger(__name__)
 
 
 def main(page: ft.Page):
     logger.info("Application starting...")
+    # Load the tag dictionary in the background while the UI is built
+    TAG_LOADER.start()
     page.padding = 0
     page.spacing = 0
     page.theme_mode = ft.ThemeMode.DARK
@@ -22,10 +25,12 @@ def main(page: ft.Page):
     # Ensure ComfyUIClient's WebSocket connection is closed on app disconnect
     def on_disconnect(e):
         logger.info("Application disconnecting...")
+        # Stop the per-session worker threads so the view can be freed
+        home.input_bar.close()
         if home.gen_service:
-            home.gen_service.cancel_generation()
-        if home.comfy_client and home.comfy_client.is_connected():
-            home.comfy_client.close_ws_connection()
+            home.gen_service.close()
+        if home.comfy_client:
+            home.comfy_client.close()
 
     page.on_disconnect = on_disconnect
 
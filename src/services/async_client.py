@@ -0,0 +1,252 @@
+# src/services/async_client.py
+import asyncio
+import json
+import uuid
+from typing import AsyncIterator
+import httpx
+from websockets.asyncio.client import connect as ws_connect
+from websockets.exceptions import ConnectionClosed, WebSocketException
+from services.binary_frames import BinaryFrame, decode_frame
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class AsyncComfyUIClient:
+    """
+    asyncio counterpart of ComfyUIClient.
+
+    Offers the same surface (connect, queue_prompt, get_history,
+    interrupt_generation, get_image, receive_ws_message) as coroutines, plus
+    events() to iterate over WebSocket messages. Many clients and jobs can
+    share one event loop, and Flet's async page handlers can await it
+    directly instead of starting threads.
+    """
+
+    def __init__(
+        self,
+        api_url=None,
+        max_connections=8,
+        max_keepalive_connections=4,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+    ):
+        self._api_url = api_url
+        self._client_id = str(uuid.uuid4())
+        self._ws = None  # WebSocket connection
+        self._connected = False
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        # One pooled keep-alive HTTP client shared by every endpoint
+        self._http = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+        )
+        logger.info(f"AsyncComfyUIClient initialized with client_id: {self._client_id}")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def api_url(self):
+        return self._api_url
+
+    @property
+    def client_id(self):
+        return self._client_id
+
+    async def set_api_url(self, api_url):
+        if self._api_url != api_url:
+            logger.info(f"API URL set to: {api_url}")
+            self._api_url = api_url
+            # If URL changes, we should disconnect the old connection
+            if self._connected:
+                await self.close_ws_connection()
+
+    def _ws_url(self):
+        ws_protocol = "wss" if self._api_url.startswith("https") else "ws"
+        return f"{ws_protocol}://{self._api_url.split('//')[1]}/ws?clientId={self._client_id}"
+
+    async def connect(self):
+        """
+        Tests the HTTP connection to the ComfyUI API and establishes a WebSocket connection.
+        Closes any existing WebSocket connection before attempting a new one.
+        """
+        if not self._api_url:
+            logger.error("ComfyUI API URL is not set. Cannot connect.")
+            return False
+
+        if self._connected:
+            logger.info(
+                "Already connected. Closing existing connection before reconnecting."
+            )
+            await self.close_ws_connection()
+
+        ws_url = self._ws_url()
+        try:
+            logger.debug(f"Testing HTTP connection to {self._api_url}/history")
+            response = await self._http.get(f"{self._api_url}/history")
+            response.raise_for_status()
+            logger.info(
+                f"Successfully connected to ComfyUI HTTP API at {self._api_url}"
+            )
+
+            logger.debug(f"Establishing WebSocket connection to {ws_url}")
+            self._ws = await ws_connect(
+                ws_url,
+                open_timeout=self.timeout.connect,
+                # ComfyUI can send large binary previews
+                max_size=None,
+            )
+            logger.info(f"Successfully connected to ComfyUI WebSocket at {ws_url}")
+            self._connected = True
+            return True
+        except httpx.TimeoutException:
+            logger.error(
+                f"Connection to ComfyUI HTTP API at {self._api_url} timed out.",
+                exc_info=True,
+            )
+        except httpx.HTTPError as e:
+            logger.error(f"Error connecting to ComfyUI HTTP API: {e}", exc_info=True)
+        except (WebSocketException, OSError, asyncio.TimeoutError) as e:
+            logger.error(f"Error connecting to ComfyUI WebSocket: {e}", exc_info=True)
+        except Exception as e:
+            logger.error(
+                f"An unexpected error occurred during connection: {e}", exc_info=True
+            )
+        self._connected = False
+        return False
+
+    def is_connected(self):
+        return self._connected and self._ws is not None
+
+    async def queue_prompt(self, prompt_workflow):
+        """
+        Queues a prompt to ComfyUI.
+        """
+        if not self.is_connected():
+            logger.error("Not connected to ComfyUI. Cannot queue prompt.")
+            return None
+
+        payload = {"prompt": prompt_workflow, "client_id": self._client_id}
+        logger.debug("Queuing prompt...")
+        try:
+            response = await self._http.post(f"{self._api_url}/prompt", json=payload)
+            response.raise_for_status()
+            logger.info("Prompt queued successfully.")
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"Error queuing prompt to ComfyUI: {e}", exc_info=True)
+            return None
+
+    async def get_history(self, prompt_id):
+        """
+        Retrieves the history for a given prompt_id.
+        """
+        if not self.is_connected():
+            logger.error("Not connected to ComfyUI. Cannot get history.")
+            return None
+        logger.debug(f"Getting history for prompt_id: {prompt_id}")
+        try:
+            response = await self._http.get(f"{self._api_url}/history/{prompt_id}")
+            response.raise_for_status()
+            logger.debug("History retrieved successfully.")
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error(
+                f"Error getting history for prompt {prompt_id}: {e}", exc_info=True
+            )
+            return None
+
+    async def get_image(self, filename, subfolder, folder_type):
+        """
+        Downloads an output image from the /view endpoint.
+        Returns the raw image bytes, or None on failure.
+        """
+        logger.debug(f"Fetching image {filename} from /view")
+        try:
+            response = await self._http.get(
+                f"{self._api_url}/view",
+                params={
+                    "filename": filename,
+                    "subfolder": subfolder,
+                    "type": folder_type,
+                },
+            )
+            response.raise_for_status()
+            return response.content
+        except httpx.HTTPError as e:
+            logger.error(f"Error fetching image {filename}: {e}", exc_info=True)
+            return None
+
+    async def interrupt_generation(self):
+        """
+        Sends an interrupt request to the ComfyUI server.
+        """
+        if not self.is_connected():
+            logger.error("Not connected to ComfyUI. Cannot interrupt.")
+            return
+
+        logger.info("Sending interrupt request.")
+        try:
+            response = await self._http.post(f"{self._api_url}/interrupt")
+            response.raise_for_status()
+            logger.info("Interrupt request sent successfully.")
+        except httpx.HTTPError as e:
+            logger.error(f"Error sending interrupt request: {e}", exc_info=True)
+
+    async def receive_ws_message(self, timeout=None):
+        """
+        Receives a single message from the WebSocket.
+        Returns parsed JSON for text messages, a BinaryFrame for binary (image
+        preview) messages, and None on timeout, for unknown binary frames or
+        when the connection is gone.
+        """
+        if not self.is_connected():
+            return None
+        try:
+            message = await asyncio.wait_for(self._ws.recv(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except ConnectionClosed:
+            logger.warning("WebSocket connection closed unexpectedly.")
+            await self.close_ws_connection()
+            return None
+        if isinstance(message, bytes):
+            return decode_frame(message)
+        try:
+            return json.loads(message)
+        except json.JSONDecodeError:
+            logger.error(f"Error decoding JSON from message: {message}", exc_info=True)
+            return None
+
+    async def events(self) -> AsyncIterator[dict | BinaryFrame]:
+        """
+        Yields WebSocket messages until the connection is closed.
+        """
+        while self.is_connected():
+            message = await self.receive_ws_message()
+            if message is not None:
+                yield message
+
+    async def close_ws_connection(self):
+        """
+        Closes the WebSocket connection.
+        """
+        ws, self._ws = self._ws, None
+        self._connected = False
+        if ws is not None:
+            await ws.close()
+            logger.info("WebSocket connection closed.")
+
+    async def close(self):
+        """
+        Closes the WebSocket connection and the pooled HTTP connections.
+        """
+        await self.close_ws_connection()
+        await self._http.aclose()
@@ -0,0 +1,65 @@
+# src/services/binary_frames.py
+import json
+import struct
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Binary WebSocket frames start with a big-endian u32 event type
+# (ComfyUI's BinaryEventTypes). Types not listed here are dropped.
+PREVIEW_IMAGE = 1  # u32 image format, then the encoded image
+PREVIEW_IMAGE_WITH_METADATA = 4  # u32 metadata length, JSON metadata, image
+IMAGE_FORMATS = {1: "image/jpeg", 2: "image/png"}
+
+_U32 = struct.Struct(">I")
+
+
+class BinaryFrame:
+    """
+    A decoded binary WebSocket frame. data is a memoryview into the received
+    message, so the image is never copied out of it.
+    """
+
+    __slots__ = ("event_type", "image_type", "data", "metadata")
+
+    def __init__(self, event_type, image_type, data, metadata=None):
+        self.event_type = event_type
+        self.image_type = image_type  # MIME type of data
+        self.data = data
+        self.metadata = metadata
+
+    @property
+    def prompt_id(self):
+        return self.metadata.get("prompt_id") if self.metadata else None
+
+    @property
+    def node_id(self):
+        return self.metadata.get("node_id") if self.metadata else None
+
+
+def decode_frame(message: bytes) -> BinaryFrame | None:
+    """
+    Parses the header of a binary frame without copying the payload.
+    Returns None for truncated frames and for unknown event types or image
+    formats.
+    """
+    view = memoryview(message)
+    if len(view) < 8:
+        return None
+    event_type = _U32.unpack_from(view, 0)[0]
+    if event_type == PREVIEW_IMAGE:
+        image_type = IMAGE_FORMATS.get(_U32.unpack_from(view, 4)[0])
+        if image_type is None:
+            return None
+        return BinaryFrame(event_type, image_type, view[8:])
+    if event_type == PREVIEW_IMAGE_WITH_METADATA:
+        end = 8 + _U32.unpack_from(view, 4)[0]
+        if end > len(view):
+            return None
+        try:
+            metadata = json.loads(view[8:end].tobytes())
+        except ValueError:
+            logger.warning("Dropping binary frame with invalid metadata.")
+            return None
+        return BinaryFrame(event_type, metadata.get("image_type"), view[end:], metadata)
+    return None
@@ -1,11 +1,27 @@
 import requests
+from requests.adapters import HTTPAdapter
 import websocket  # websocket-client is imported as websocket
 import json
+import queue
+import random
+import threading
+import time
 import uuid
+from collections import OrderedDict, deque
+from services.binary_frames import BinaryFrame, decode_frame
 from utils.logger import get_logger
 
 logger = get_logger(__name__)
 
+# Messages buffered for prompts that nobody has subscribed to yet, e.g. the
+# ones that arrive between queue_prompt() returning and subscribe()
+MAX_PENDING_PROMPTS = 16
+MAX_PENDING_MESSAGES = 256
+# Newest messages kept for receive_ws_message(); older ones are dropped
+MAX_INBOX_MESSAGES = 256
+# Chunk size for streamed image downloads
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
 
 class UsageClient:
     def __init__(self, connection):
@@ -16,13 +32,71 @@ class UsageClient:
 
 
 class ComfyUIClient:
-    def __init__(self, api_url=None):
+    def __init__(
+        self,
+        api_url=None,
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=2,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        auto_reconnect=True,
+        reconnect_base_delay=0.5,
+        reconnect_max_delay=30.0,
+    ):
         self._api_url = api_url
         self._client_id = str(uuid.uuid4())
         self._ws = None  # WebSocket connection
         self._connected = False
+        self._reader = None  # Thread reading the WebSocket
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, queue.Queue] = {}
+        self._pending: OrderedDict[str, deque] = OrderedDict()
+        self._listeners = []
+        self._inbox = None  # Every message once listen_all() is called
+        self._inbox_ready = threading.Condition(self._lock)
+        # Binary previews carry no prompt_id; they belong to the running prompt
+        self._executing_prompt_id = None
+        # Reconnect after an unexpected drop, with the same client_id so the
+        # server keeps sending this client the events of its prompts
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_base_delay = reconnect_base_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        # Bumped by connect() and close_ws_connection() to stop a pending
+        # reconnect
+        self._epoch = 0
+        # Held while a connection is being opened, so connect() and the
+        # background reconnect never open two sockets and readers at once
+        self._connect_lock = threading.Lock()
+        # (connect, read) timeout applied to every HTTP request
+        self.timeout = (connect_timeout, read_timeout)
+        self._session = self._create_session(
+            pool_connections, pool_maxsize, max_retries
+        )
         logger.info(f"ComfyUIClient initialized with client_id: {self._client_id}")
 
+    @staticmethod
+    def _create_session(pool_connections, pool_maxsize, max_retries):
+        """
+        Creates the HTTP session shared by every endpoint. Connections are kept
+        alive and reused, so only the first request to a host pays for the TCP
+        and TLS handshakes. pool_connections is the number of hosts kept in the
+        pool and pool_maxsize the number of open connections per host.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=max_retries,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def session(self):
+        return self._session
+
     @property
     def api_url(self):
         return self._api_url
@@ -40,7 +114,14 @@ class ComfyUIClient:
         """
         Tests the HTTP connection to the ComfyUI API and establishes a WebSocket connection.
         Closes any existing WebSocket connection before attempting a new one.
+        Waits for a background reconnect that is opening a connection, and
+        stops it from retrying afterwards.
         """
+        with self._connect_lock:
+            self._epoch += 1
+            return self._open_connection()
+
+    def _open_connection(self):
         if not self._api_url:
             logger.error("ComfyUI API URL is not set. Cannot connect.")
             return False
@@ -54,9 +135,9 @@ class ComfyUIClient:
         try:
             # Test HTTP connection
             logger.debug(f"Testing HTTP connection to {self._api_url}/history")
-            response = requests.get(
-                f"{self._api_url}/history", timeout=5
-            )  # Add timeout
+            response = self._session.get(
+                f"{self._api_url}/history", timeout=self.timeout
+            )
             response.raise_for_status()
             logger.info(
                 f"Successfully connected to ComfyUI HTTP API at {self._api_url}"
@@ -69,6 +150,8 @@ class ComfyUIClient:
             self._ws = websocket.create_connection(ws_url, timeout=5)  # Add timeout
             logger.info(f"Successfully connected to ComfyUI WebSocket at {ws_url}")
             self._connected = True
+            self._start_reader()
+            self._reconcile_in_flight()
             return True
         except requests.exceptions.ConnectionError as e:
             logger.error(
@@ -118,8 +201,11 @@ class ComfyUIClient:
         headers = {"Content-Type": "application/json"}
         logger.debug("Queuing prompt...")
         try:
-            response = requests.post(
-                f"{self._api_url}/prompt", data=json.dumps(payload), headers=headers
+            response = self._session.post(
+                f"{self._api_url}/prompt",
+                data=json.dumps(payload),
+                headers=headers,
+                timeout=self.timeout,
             )
             response.raise_for_status()
             logger.info("Prompt queued successfully.")
@@ -137,7 +223,9 @@ class ComfyUIClient:
             return None
         logger.debug(f"Getting history for prompt_id: {prompt_id}")
         try:
-            response = requests.get(f"{self._api_url}/history/{prompt_id}")
+            response = self._session.get(
+                f"{self._api_url}/history/{prompt_id}", timeout=self.timeout
+            )
             response.raise_for_status()
             logger.debug("History retrieved successfully.")
             return response.json()
@@ -147,30 +235,386 @@ class ComfyUIClient:
             )
             return None
 
-    def receive_ws_message(self):
+    def get_queue(self):
+        """
+        Retrieves the running and pending prompts from the /queue endpoint.
+        """
+        if not self.is_connected():
+            logger.error("Not connected to ComfyUI. Cannot get queue.")
+            return None
+        try:
+            response = self._session.get(f"{self._api_url}/queue", timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error getting queue: {e}", exc_info=True)
+            return None
+
+    def delete_queued(self, prompt_ids):
+        """
+        Removes prompts that have not started yet from the server queue.
+        """
+        if not self.is_connected():
+            logger.error("Not connected to ComfyUI. Cannot delete queued prompts.")
+            return
+        try:
+            response = self._session.post(
+                f"{self._api_url}/queue",
+                json={"delete": list(prompt_ids)},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error deleting queued prompts: {e}", exc_info=True)
+
+    def get_image(self, filename, subfolder, folder_type):
+        """
+        Downloads an output image from the /view endpoint.
+        Returns the raw image bytes, or None on failure.
+        """
+        logger.debug(f"Fetching image {filename} from /view")
+        try:
+            response = self._session.get(
+                f"{self._api_url}/view",
+                params={
+                    "filename": filename,
+                    "subfolder": subfolder,
+                    "type": folder_type,
+                },
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            return response.content
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error fetching image {filename}: {e}", exc_info=True)
+            return None
+
+    def download_image(
+        self,
+        filename,
+        subfolder,
+        folder_type,
+        on_progress=None,
+        chunk_size=DOWNLOAD_CHUNK_SIZE,
+        max_resumes=3,
+    ):
         """
-        Receives a single message from the WebSocket.
-        Handles both text (JSON) and binary (image preview) messages.
+        Streams an output image from the /view endpoint into a single buffer
+        sized from Content-Length, so peak memory stays at about one copy of
+        the image. on_progress(received, total) is called after every chunk;
+        total is None if the server did not send a length. If the transfer
+        breaks, it resumes from the last received byte with a Range request,
+        up to max_resumes times. Returns the image as a bytearray, or None on
+        failure.
         """
-        if self._ws and self._connected:
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        buffer = bytearray()
+        total = None
+        received = 0
+        resumes = 0
+        logger.debug(f"Streaming image {filename} from /view")
+        while True:
+            headers = {"Range": f"bytes={received}-"} if received else {}
             try:
-                message = self._ws.recv()
-                if isinstance(message, str):
-                    return json.loads(message)
-                elif isinstance(message, bytes):
-                    return message  # Return raw bytes for binary messages
-            except websocket._exceptions.WebSocketConnectionClosedException:
-                logger.warning("WebSocket connection closed unexpectedly.")
-                self.close_ws_connection()
-            except websocket._exceptions.WebSocketTimeoutException:
-                return None
-            except json.JSONDecodeError as e:
-                logger.error(
-                    f"Error decoding JSON from message: {message}", exc_info=True
+                with self._session.get(
+                    f"{self._api_url}/view",
+                    params=params,
+                    headers=headers,
+                    timeout=self.timeout,
+                    stream=True,
+                ) as response:
+                    response.raise_for_status()
+                    if received and response.status_code != 206:
+                        # The server ignored the Range header; start over
+                        received = 0
+                    if not received:
+                        length = response.headers.get("Content-Length")
+                        total = int(length) if length else None
+                        buffer = bytearray(total or 0)
+                    view = memoryview(buffer)
+                    for chunk in response.iter_content(chunk_size):
+                        end = received + len(chunk)
+                        if total is not None and end <= total:
+                            view[received:end] = chunk
+                        else:
+                            view.release()
+                            buffer[received:] = chunk
+                            view = memoryview(buffer)
+                        received = end
+                        if on_progress:
+                            on_progress(received, total)
+                    view.release()
+                if total is not None and received < total:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Transfer ended at {received} of {total} bytes"
+                    )
+                del buffer[received:]
+                return buffer
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout,
+            ) as e:
+                if resumes >= max_resumes:
+                    logger.error(
+                        f"Error streaming image {filename}: {e}", exc_info=True
+                    )
+                    return None
+                resumes += 1
+                logger.warning(
+                    f"Image download interrupted at {received} bytes, resuming ({e})"
                 )
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Error streaming image {filename}: {e}", exc_info=True)
+                return None
+
+    def _start_reader(self):
+        self._reader = threading.Thread(
+            target=self._read_loop, args=(self._ws,), daemon=True
+        )
+        self._reader.start()
+
+    def _read_loop(self, ws):
+        """
+        Reads the WebSocket for as long as it is the current connection and
+        hands every message to _dispatch(). This is the only place recv() is
+        called, so messages are never lost between jobs.
+        """
+        logger.debug("WebSocket reader started.")
+        while self._ws is ws:
+            try:
+                message = ws.recv()
+            except websocket._exceptions.WebSocketTimeoutException:
+                continue
+            except Exception as e:
+                if self._ws is ws:
+                    logger.warning(f"WebSocket connection closed unexpectedly: {e}")
+                    self._handle_disconnect(ws)
+                break
+            if not message:
+                continue  # Close frame; the next recv() raises
+            if isinstance(message, str):
+                try:
+                    message = json.loads(message)
+                except json.JSONDecodeError:
+                    logger.error(f"Error decoding JSON from message: {message}")
+                    continue
+            try:
+                self._dispatch(message)
             except Exception as e:
-                logger.error(f"Error receiving WebSocket message: {e}", exc_info=True)
-        return None
+                logger.error(f"Error dispatching WebSocket message: {e}", exc_info=True)
+        logger.debug("WebSocket reader stopped.")
+
+    def _handle_disconnect(self, ws):
+        epoch = self._epoch
+        self._ws = None
+        self._connected = False
+        self._executing_prompt_id = None
+        try:
+            ws.close()
+        except Exception:
+            pass
+        if self.auto_reconnect:
+            self._reconnect(epoch)
+
+    def _reconnect(self, epoch):
+        """
+        Retries connect() with jittered exponential backoff until it succeeds
+        or the connection is closed or replaced by someone else. Full jitter
+        keeps many clients that lost the same server from retrying in step.
+        """
+        attempt = 0
+        while self._epoch == epoch and not self.is_connected():
+            delay = min(
+                self.reconnect_max_delay, self.reconnect_base_delay * 2**attempt
+            )
+            attempt += 1
+            time.sleep(random.uniform(0, delay))
+            with self._connect_lock:
+                # connect() may have run while this thread was sleeping
+                if self._epoch != epoch or self.is_connected():
+                    return
+                logger.info(f"Reconnecting to ComfyUI (attempt {attempt})...")
+                connected = self._open_connection()
+            if connected:
+                logger.info(f"Reconnected to ComfyUI after {attempt} attempt(s).")
+                return
+
+    def _reconcile_in_flight(self):
+        """
+        Catches up subscribed prompts after a reconnect. Prompts still in the
+        server queue keep receiving live events. Prompts that finished while
+        the WebSocket was down get their results replayed from /history as
+        "executed" and "executing" messages, and prompts the server no longer
+        knows about get an "execution_error".
+        """
+        with self._lock:
+            prompt_ids = list(self._subscribers)
+        if not prompt_ids:
+            return
+        server_queue = self.get_queue()
+        if server_queue is None:
+            return
+        queued = {
+            item[1]
+            for key in ("queue_running", "queue_pending")
+            for item in server_queue.get(key, [])
+        }
+        for prompt_id in prompt_ids:
+            if prompt_id in queued:
+                continue
+            history = self.get_history(prompt_id)
+            if history is None:
+                continue
+            messages = self._history_messages(prompt_id, history.get(prompt_id))
+            logger.info(f"Recovered prompt {prompt_id} from history.")
+            with self._lock:
+                subscriber = self._subscribers.get(prompt_id)
+                if subscriber is not None:
+                    for message in messages:
+                        subscriber.put(message)
+
+    @staticmethod
+    def _history_messages(prompt_id, entry) -> list[dict]:
+        """Rebuilds the final WebSocket messages of a prompt from its history."""
+        if entry is None:
+            return [
+                {
+                    "type": "execution_error",
+                    "data": {
+                        "prompt_id": prompt_id,
+                        "exception_message": "Prompt was lost while disconnected.",
+                    },
+                }
+            ]
+        status = entry.get("status") or {}
+        if status.get("status_str") == "error":
+            for name, data in reversed(status.get("messages", [])):
+                if name in ("execution_error", "execution_interrupted"):
+                    return [{"type": name, "data": data}]
+            return [{"type": "execution_error", "data": {"prompt_id": prompt_id}}]
+        messages = [
+            {
+                "type": "executed",
+                "data": {"node": node_id, "output": output, "prompt_id": prompt_id},
+            }
+            for node_id, output in (entry.get("outputs") or {}).items()
+        ]
+        messages.append(
+            {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}}
+        )
+        return messages
+
+    def _dispatch(self, message):
+        """
+        Routes a message to the queue of the prompt it belongs to. Binary
+        frames are decoded into BinaryFrame objects first. Messages for
+        prompts without a subscriber are buffered until subscribe() is called.
+        Listeners and the receive_ws_message() inbox see every message.
+        """
+        if isinstance(message, bytes):
+            message = decode_frame(message)
+            if message is None:
+                return  # Unknown frame type
+            prompt_id = message.prompt_id or self._executing_prompt_id
+        else:
+            data = message.get("data") or {}
+            prompt_id = data.get("prompt_id")
+            msg_type = message.get("type")
+            if prompt_id and msg_type == "execution_start":
+                self._executing_prompt_id = prompt_id
+            elif prompt_id and msg_type == "executing":
+                # node None means the prompt has finished
+                finished = data.get("node") is None
+                self._executing_prompt_id = None if finished else prompt_id
+
+        for listener in list(self._listeners):
+            try:
+                listener(message)
+            except Exception as e:
+                logger.error(f"WebSocket listener failed: {e}", exc_info=True)
+
+        with self._lock:
+            if self._inbox is not None:
+                self._inbox.append(message)
+                self._inbox_ready.notify()
+            if prompt_id is None:
+                return
+            subscriber = self._subscribers.get(prompt_id)
+            if subscriber is not None:
+                subscriber.put(message)
+                return
+            pending = self._pending.get(prompt_id)
+            if pending is None:
+                if len(self._pending) >= MAX_PENDING_PROMPTS:
+                    self._pending.popitem(last=False)
+                pending = self._pending[prompt_id] = deque(maxlen=MAX_PENDING_MESSAGES)
+            pending.append(message)
+
+    def client_for(self, prompt_id) -> "ComfyUIClient | None":
+        """
+        Returns the client that prompt_id was queued on, or None if it is
+        unknown (see ComfyServerPool). A single client owns every prompt it
+        queued, so this is always the client itself.
+        """
+        return self
+
+    def subscribe(self, prompt_id) -> queue.Queue:
+        """
+        Returns a queue receiving the WebSocket messages of prompt_id: parsed
+        JSON for text messages and BinaryFrame objects for binary (image
+        preview) messages. Messages that arrived before the call are delivered first.
+        """
+        events = queue.Queue()
+        with self._lock:
+            for message in self._pending.pop(prompt_id, ()):
+                events.put(message)
+            self._subscribers[prompt_id] = events
+        return events
+
+    def unsubscribe(self, prompt_id):
+        """Stops routing messages for prompt_id."""
+        with self._lock:
+            self._subscribers.pop(prompt_id, None)
+            self._pending.pop(prompt_id, None)
+
+    def add_listener(self, callback):
+        """
+        Calls callback(message) for every WebSocket message, including those
+        without a prompt_id such as "status". Runs on the reader thread, so
+        callbacks must not block.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def listen_all(self):
+        """
+        Starts keeping every WebSocket message for receive_ws_message(). Call
+        it before queue_prompt() so no message of the prompt is missed. Only
+        the newest MAX_INBOX_MESSAGES are kept if nobody reads them.
+        """
+        with self._lock:
+            if self._inbox is None:
+                self._inbox = deque(maxlen=MAX_INBOX_MESSAGES)
+
+    def receive_ws_message(self, timeout=5):
+        """
+        Receives a single message from the WebSocket, whatever prompt it
+        belongs to. Returns parsed JSON for text messages, a BinaryFrame for binary
+        (image preview) messages, and None on timeout. Messages are kept from
+        the listen_all() call on, or from the first call of this method
+        otherwise; prefer subscribe() for a single prompt.
+        """
+        self.listen_all()
+        if not self.is_connected():
+            return None
+        with self._inbox_ready:
+            if not self._inbox_ready.wait_for(lambda: self._inbox, timeout):
+                return None
+            return self._inbox.popleft()
 
     def interrupt_generation(self):
         """
@@ -182,7 +626,9 @@ class ComfyUIClient:
 
         logger.info("Sending interrupt request.")
         try:
-            response = requests.post(f"{self._api_url}/interrupt")
+            response = self._session.post(
+                f"{self._api_url}/interrupt", timeout=self.timeout
+            )
             response.raise_for_status()
             logger.info("Interrupt request sent successfully.")
         except requests.exceptions.RequestException as e:
@@ -192,8 +638,18 @@ class ComfyUIClient:
         """
         Closes the WebSocket connection.
         """
-        if self._ws and self._ws.connected:
-            self._ws.close()
-            logger.info("WebSocket connection closed.")
-        self._ws = None
+        self._epoch += 1
+        ws, self._ws = self._ws, None
         self._connected = False
+        self._executing_prompt_id = None
+        if ws and ws.connected:
+            # Also wakes the reader thread, which exits once _ws has changed
+            ws.close()
+            logger.info("WebSocket connection closed.")
+
+    def close(self):
+        """
+        Closes the WebSocket connection and the pooled HTTP connections.
+        """
+        self.close_ws_connection()
+        self._session.close()
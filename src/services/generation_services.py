@@ -1,14 +1,29 @@
 # src/services/generation_service.py
 import threading
+import itertools
 import json
+import queue
 import os
-import requests
-import base64
-from typing import TypedDict, Optional, Literal
+from typing import TypedDict, NotRequired, Optional, Literal, Sequence
+from services.binary_frames import BinaryFrame
+from services.model_affinity import ModelSwapStats
+from services.result_cache import ResultCache, result_key
+from utils.data import WORKFLOW_TEMPLATE_PATH
 from utils.logger import get_logger
+from utils.workflow_bindings import GGUF_BINDINGS, Binding, PatchPlan
+from utils.workflow_template import WorkflowTemplate, apply_patches
 
 logger = get_logger(__name__)
 
+# Output node that sends its images as binary WebSocket frames instead of
+# saving them for /view (ComfyUI's websocket_image_save example node)
+WEBSOCKET_OUTPUT_CLASS = "SaveImageWebsocket"
+IMAGE_OUTPUT_CLASSES = ("PreviewImage", "SaveImage")
+# Times a pending job may be passed over for same-model jobs
+MAX_AFFINITY_BYPASS = 3
+# Finished, failed and cancelled jobs kept for list_jobs()
+MAX_FINISHED_JOBS = 50
+
 
 class FaceDetailerSetting(TypedDict):
     steps: int
@@ -31,9 +46,77 @@ class GenerationSetting(TypedDict):
     width: int
     height: int
     Face_detailer_switch: int
+    batch_size: NotRequired[int]  # Images per job; set by enqueue_sweep()
+
+
+class JobState:
+    PENDING = "pending"  # Waiting in the client-side queue
+    QUEUED = "queued"  # Sent to the server, waiting for the GPU
+    RUNNING = "running"
+    DOWNLOADING = "downloading"
+    FINISHED = "finished"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+    # States that occupy one of the max_in_flight server slots; a job that
+    # is only downloading its images no longer holds up the server queue
+    IN_FLIGHT = (QUEUED, RUNNING)
+    DONE = (FINISHED, FAILED, CANCELLED)
+
+
+class GenerationJob:
+    """One generation request and its progress through the queue."""
+
+    def __init__(
+        self,
+        job_id: int,
+        setting: GenerationSetting,
+        face_detailer_setting: FaceDetailerSetting | None = None,
+        priority: int = 0,
+    ):
+        self.job_id = job_id
+        self.setting = setting
+        self.face_detailer_setting = face_detailer_setting
+        self.priority = priority  # Higher runs first
+        self.state = JobState.PENDING
+        self.prompt_id = None
+        self.client = None  # Client the prompt was queued on
+        self.error = None
+        self.bypassed = 0  # Times a same-model job was sent ahead of this one
+        self.avoided_swap = False
+        # Built when the job is enqueued, so the result cache can be checked
+        # before the job waits for the server
+        self.workflow = None
+        self.websocket_nodes = frozenset()
+        self.cache_key = None  # Result cache key of the workflow
+
+    @property
+    def model(self):
+        return self.setting.get("model")
+
+    def as_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "priority": self.priority,
+            "prompt_id": self.prompt_id,
+            "model": self.model,
+            "positive_prompt": self.setting.get("positive_prompt"),
+            "error": self.error,
+        }
 
 
 class GenerationService:
+    """
+    Runs generation jobs through a client-side queue.
+
+    Up to max_in_flight prompts are kept queued on the server, so the next
+    job is already waiting when the GPU finishes the current one, and its
+    image is downloaded while the next job runs. Pending jobs are sent in
+    priority order; among equal priorities a job for the model the server
+    last received is sent first, unless that would skip the oldest job more
+    than MAX_AFFINITY_BYPASS times.
+    """
+
     def __init__(
         self,
         comfy_client,
@@ -41,31 +124,58 @@ class GenerationService:
         on_status_update,
         on_image_update,
         on_preview_update,
+        websocket_images=False,
+        max_in_flight=2,
+        on_job_complete=None,
+        template: WorkflowTemplate | None = None,
+        bindings: Sequence[Binding] = GGUF_BINDINGS,
+        result_cache: ResultCache | None = None,
     ):
         self.comfy_client = comfy_client
         self.on_progress_update = on_progress_update  # Callback to update UI bar
         self.on_status_update = on_status_update  # Callback to update UI text
-        self.on_image_update = on_image_update  # Callback to update main image
-        self.on_preview_update = on_preview_update  # Callback to update preview image
-        self._is_generating = False
-        self._prompt_id = None
-        self._model_loader_node_id = "1"
-        self._positive_prompt_node_id = "4"
-        self._k_sampler_node_id = "7"
-        self._empty_latent_image_node_id = "8"
-        self._face_detailer_node_id = "13"
-        self._face_detailer_switch_node_id = "21"
+        self.on_image_update = on_image_update  # Callback taking raw image bytes
+        self.on_preview_update = on_preview_update  # Callback taking preview bytes
+        # Optional callback taking (job_id, list of image bytes) per finished job
+        self.on_job_complete = on_job_complete
+        # Receive final images over the WebSocket; the server needs the
+        # SaveImageWebsocket node installed
+        self.websocket_images = websocket_images
+        self.max_in_flight = max_in_flight
+        # Parsed once and re-read only when the file changes
+        self.template = template or WorkflowTemplate(WORKFLOW_TEMPLATE_PATH)
+        # Which settings fields go to which node inputs of the template
+        self.bindings = bindings
+        self._plan = None
+        self._plan_version = None
+        self._plan_lock = threading.Lock()
+        # Images of finished workflows; a repeat workflow is not sent again
+        self.result_cache = result_cache
+        # Model last sent to each client, to count model swaps
+        self._last_models = {}
+        self._last_model = None
+        # A ComfyServerPool counts the swaps of the prompts it routes; share
+        # its stats instead of counting the same jobs twice
+        self._pool_stats = getattr(comfy_client, "model_stats", None)
+        self.model_stats = self._pool_stats or ModelSwapStats()
+        self._jobs: dict[int, GenerationJob] = {}
+        self._job_ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._closed = False
+        threading.Thread(target=self._dispatch_jobs, daemon=True).start()
 
     def start_generation(
         self,
         setting: GenerationSetting,
         face_detailer_setting: FaceDetailerSetting | None = None,
-    ):
-        if self._is_generating:
-            logger.warning("Generation already in progress.")
-            return
-
-        if not self.comfy_client.is_connected():
+    ) -> int | None:
+        """
+        Enqueues a job, connecting first if it has to go to the server.
+        Returns its job_id. A job answered from the result cache needs no
+        connection.
+        """
+        job, cached = self._new_job(setting, face_detailer_setting)
+        if cached is None and not self.comfy_client.is_connected():
             logger.info("Client not connected, attempting to reconnect...")
             self.on_status_update(
                 "Connecting...", "Re-establishing link", "BLUE_200", "ORANGE_400"
@@ -73,197 +183,521 @@ class GenerationService:
             if not self.comfy_client.connect():
                 logger.error("Failed to reconnect to ComfyUI.")
                 self.on_status_update("Error", "Not Connected", "RED_500", "RED_500")
-                return
+                return None
 
-        setting_log = setting.get("positive_prompt")
-        logger.info(f"Starting generation for '{setting_log}'")
-        self._is_generating = True
+        return self._add_job(job, cached)
 
-        self.on_status_update("Queuing...", "Sending prompt", "BLUE_200", "ORANGE_400")
-        self.on_progress_update(0.01)  # Small initial progress
+    def enqueue(
+        self,
+        setting: GenerationSetting,
+        face_detailer_setting: FaceDetailerSetting | None = None,
+        priority: int = 0,
+    ) -> int:
+        """
+        Adds a job to the queue and returns its job_id. A job whose workflow
+        is in the result cache is answered at once instead.
+        """
+        job, cached = self._new_job(setting, face_detailer_setting, priority)
+        return self._add_job(job, cached)
 
-        threading.Thread(
-            target=self._real_generation_process,
-            args=(
-                setting,
-                face_detailer_setting,
+    def _new_job(
+        self,
+        setting: GenerationSetting,
+        face_detailer_setting: FaceDetailerSetting | None = None,
+        priority: int = 0,
+    ) -> tuple[GenerationJob, list | None]:
+        """
+        Creates a job with its workflow and returns it with its cached images,
+        or None if the workflow is not in the result cache.
+        """
+        job = GenerationJob(
+            next(self._job_ids), setting, face_detailer_setting, priority
+        )
+        try:
+            job.workflow, job.websocket_nodes = self._prepare_workflow(job)
+        except Exception as e:
+            logger.error(f"Failed to build job {job.job_id}: {e}", exc_info=True)
+            job.state, job.error = JobState.FAILED, str(e)
+            return job, None
+        if self.result_cache is None:
+            return job, None
+        job.cache_key = result_key(job.workflow, job.model)
+        return job, self.result_cache.get(job.cache_key)
+
+    def _add_job(self, job: GenerationJob, cached: list | None) -> int:
+        """
+        Registers a job from _new_job(). Cache hits are delivered here and
+        never reach the dispatcher; misses wait for a max_in_flight slot.
+        """
+        with self._condition:
+            if cached and job.state == JobState.PENDING:
+                job.state = JobState.DOWNLOADING  # Read from the cache
+            self._jobs[job.job_id] = job
+            self._condition.notify_all()
+        if job.state == JobState.FAILED:
+            self.on_status_update("Error", "Failed", "RED_500", "RED_500")
+        elif cached:
+            logger.info(f"Job {job.job_id} answered from the result cache.")
+            self._deliver_results(job, cached)
+            self._complete_job(job)
+        else:
+            logger.info(
+                f"Enqueued job {job.job_id} for '{job.setting.get('positive_prompt')}'"
+            )
+        return job.job_id
+
+    def enqueue_sweep(
+        self,
+        setting: GenerationSetting,
+        face_detailer_setting: FaceDetailerSetting | None = None,
+        seeds=None,
+        steps=None,
+        cfgs=None,
+        sampler_names=None,
+        batch_size: int | None = None,
+        priority: int = 0,
+    ) -> list[int]:
+        """
+        Enqueues one job per combination of seeds x steps x cfgs x
+        sampler_names; parameters left as None keep the value from setting.
+        seeds may be any iterable such as range(100, 110). batch_size sets the
+        EmptyLatentImage batch so each job renders that many images in one
+        pass. Returns the job_ids in submission order.
+        """
+        grid = itertools.product(
+            seeds if seeds is not None else [setting.get("seed")],
+            steps if steps is not None else [setting.get("steps")],
+            cfgs if cfgs is not None else [setting.get("cfg")],
+            (
+                sampler_names
+                if sampler_names is not None
+                else [setting.get("sampler_name")]
             ),
-            daemon=True,
-        ).start()
+        )
+        job_ids = []
+        for seed, step_count, cfg, sampler_name in grid:
+            job_setting = {
+                **setting,
+                "seed": seed,
+                "steps": step_count,
+                "cfg": cfg,
+                "sampler_name": sampler_name,
+            }
+            if batch_size is not None:
+                job_setting["batch_size"] = batch_size
+            job_ids.append(self.enqueue(job_setting, face_detailer_setting, priority))
+        logger.info(f"Enqueued a sweep of {len(job_ids)} jobs.")
+        return job_ids
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        Cancels a job. Pending jobs are dropped, jobs waiting on the server
+        are deleted from its queue and a running job is interrupted.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in JobState.DONE:
+                return False
+            previous, job.state = job.state, JobState.CANCELLED
+            self._condition.notify_all()
+        logger.info(f"Job {job_id} cancelled ({previous}).")
+        if job.prompt_id is not None:
+            if previous == JobState.RUNNING:
+                job.client.interrupt_generation()
+            elif previous == JobState.QUEUED:
+                job.client.delete_queued([job.prompt_id])
+        return True
 
     def cancel_generation(self):
-        if not self._is_generating:
+        """Cancels every job that has not finished yet."""
+        with self._condition:
+            job_ids = [
+                job.job_id
+                for job in self._jobs.values()
+                if job.state not in JobState.DONE
+            ]
+        if not job_ids:
             return
         logger.info("Generation cancelled by user.")
-        self._is_generating = False
-        self.comfy_client.interrupt_generation()
-        if self._prompt_id:
-            # Clear the history for the cancelled prompt
-            self.comfy_client.get_history(self._prompt_id)
+        for job_id in job_ids:
+            self.cancel(job_id)
         self.on_status_update("Cancelled", "Ready", "WHITE70", "GREEN_400")
         self.on_progress_update(0.0)
 
-    def _real_generation_process(
+    def close(self):
+        """Cancels every unfinished job and stops the dispatcher thread."""
+        self.cancel_generation()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def reprioritize(self, job_id: int, priority: int) -> bool:
+        """
+        Changes the priority of a pending job. Jobs already sent to the
+        server keep their place in its queue.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != JobState.PENDING:
+                return False
+            job.priority = priority
+            self._condition.notify_all()
+        return True
+
+    def list_jobs(self) -> list[dict]:
+        """Returns a snapshot of the queued and recently finished jobs."""
+        with self._condition:
+            return [job.as_dict() for job in self._jobs.values()]
+
+    def is_generating(self) -> bool:
+        with self._condition:
+            return any(job.state not in JobState.DONE for job in self._jobs.values())
+
+    def _count(self, states) -> int:
+        return sum(job.state in states for job in self._jobs.values())
+
+    def _next_pending(self) -> GenerationJob | None:
+        pending = [job for job in self._jobs.values() if job.state == JobState.PENDING]
+        if not pending:
+            return None
+        priority = max(job.priority for job in pending)
+        candidates = [job for job in pending if job.priority == priority]
+        head = candidates[0]
+        if (
+            self._last_model is None
+            or head.model == self._last_model
+            or head.bypassed >= MAX_AFFINITY_BYPASS
+        ):
+            return head
+        for job in candidates[1:]:
+            if job.model == self._last_model:
+                # Sending head next would swap the model twice
+                for skipped in candidates[: candidates.index(job)]:
+                    skipped.bypassed += 1
+                job.avoided_swap = True
+                return job
+        return head
+
+    def _dispatch_jobs(self):
+        """Keeps up to max_in_flight jobs queued on the server."""
+        while True:
+            with self._condition:
+                job = None
+                while job is None:
+                    if self._closed:
+                        logger.debug("Job dispatcher stopped.")
+                        return
+                    if self._count(JobState.IN_FLIGHT) < self.max_in_flight:
+                        job = self._next_pending()
+                    if job is None:
+                        self._condition.wait()
+                job.state = JobState.QUEUED
+                # Drive the UI from here only if nothing else is running
+                first = self._count(JobState.IN_FLIGHT) == 1
+                self._last_model = job.model
+            if first:
+                self.on_status_update(
+                    "Queuing...", "Sending prompt", "BLUE_200", "ORANGE_400"
+                )
+                self.on_progress_update(0.01)  # Small initial progress
+            try:
+                self._submit(job)
+            except Exception as e:
+                logger.error(f"Failed to submit job {job.job_id}: {e}", exc_info=True)
+                if self._finish_job(job, JobState.FAILED, e) is not None:
+                    self.on_status_update("Error", "Failed", "RED_500", "RED_500")
+
+    def _build_workflow(
         self,
         setting: GenerationSetting,
         face_detailer_setting: FaceDetailerSetting | None = None,
-    ):
-        """The actual generation process that runs in a thread."""
-        try:
-            logger.debug("Loading workflow template from 'assets/GGUF_WORKFLOW_API.json'")
-            # 1. Load the workflow template
-            with open("assets/GGUF_WORKFLOW_API.json", "r") as f:
-                workflow = json.load(f)
-
-            # 2. Modify the workflow with GenerationSetting
-            logger.debug(f"Modifying workflow with settings: {setting}")
-            workflow[self._model_loader_node_id]["inputs"]["unet_name"] = setting.get(
-                "model"
-            )
-
-            workflow[self._positive_prompt_node_id]["inputs"]["text"] = setting.get(
-                "positive_prompt"
+    ) -> dict:
+        """
+        Returns the job's workflow: the cached template with only the nodes
+        that settings touch copied and patched. The bindings are compiled
+        into a PatchPlan once per template version.
+        """
+        version, nodes = self.template.snapshot()
+        with self._plan_lock:  # Jobs are built on the callers' threads
+            if version != self._plan_version:
+                self._plan = PatchPlan.compile(nodes, self.bindings)
+                self._plan_version = version
+            plan = self._plan
+        logger.debug(f"Patching workflow template with settings: {setting}")
+        patches = plan.patches(
+            {"setting": setting, "face_detailer": face_detailer_setting}
+        )
+        return apply_patches(nodes, patches)
+
+    def _prepare_workflow(self, job: GenerationJob) -> tuple[dict, frozenset[str]]:
+        """Returns the job's workflow as it will be sent, and its websocket nodes."""
+        setting_log = job.setting.get("positive_prompt")
+        logger.info(f"Starting generation for '{setting_log}'")
+        workflow = self._build_workflow(job.setting, job.face_detailer_setting)
+        websocket_nodes = frozenset()
+        if self.websocket_images:
+            websocket_nodes = self._use_websocket_outputs(workflow)
+        return workflow, websocket_nodes
+
+    def _submit(self, job: GenerationJob):
+        # 3. Queue the prompt
+        logger.info("Queuing prompt...")
+        if self._pool_stats is not None:
+            response = self.comfy_client.queue_prompt(
+                job.workflow, avoided_swap=job.avoided_swap
             )
-
-            ksampler = workflow[self._k_sampler_node_id]["inputs"]
-            ksampler["seed"] = setting.get("seed")
-            ksampler["steps"] = setting.get("steps")
-            ksampler["cfg"] = setting.get("cfg")
-            ksampler["sampler_name"] = setting.get("sampler_name")
-            ksampler["scheduler"] = setting.get("scheduler")
-            # Note: "preview_image" should be a string "enable" not a boolean
-            ksampler["preview_image"] = "enable"
-
-            latent_image = workflow[self._empty_latent_image_node_id]["inputs"]
-            latent_image["width"] = setting.get("width")
-            latent_image["height"] = setting.get("height")
-
-            if face_detailer_setting:
-                logger.debug(
-                    f"Applying face detailer settings: {face_detailer_setting}"
-                )
-                face_detailer = workflow[self._face_detailer_node_id]["inputs"]
-                face_detailer["steps"] = face_detailer_setting.get("steps")
-                face_detailer["cfg"] = face_detailer_setting.get("cfg")
-                face_detailer["sampler_name"] = face_detailer_setting.get(
-                    "sampler_name"
-                )
-                face_detailer["scheduler"] = face_detailer_setting.get("scheduler")
-                face_detailer["denoise"] = face_detailer_setting.get("denoise")
-                face_detailer["bbox_threshold"] = face_detailer_setting.get(
-                    "bbox_threshold"
-                )
-                face_detailer["bbox_crop_factor"] = face_detailer_setting.get(
-                    "bbox_crop_factor"
-                )
-                # Use the main seed for the face detailer as well
-                face_detailer["seed"] = setting.get("seed")
-
-            workflow[self._face_detailer_switch_node_id]["inputs"][
-                "select"
-            ] = setting.get(
-                "Face_detailer_switch"
-            )  # The ImpactInversedSwitch expects 1-indexed values (1 or 2) from the setting.
-
-            # 3. Queue the prompt
-            logger.info("Queuing prompt...")
-            response = self.comfy_client.queue_prompt(workflow)
-            if not response or "prompt_id" not in response:
-                raise Exception("Failed to queue prompt or invalid response.")
-
-            self._prompt_id = response["prompt_id"]
-            logger.info(f"Prompt queued with ID: {self._prompt_id}")
-            self.on_status_update(
-                "Generating...", f"ID: {self._prompt_id[:8]}", "BLUE_200", "ORANGE_400"
+        else:
+            response = self.comfy_client.queue_prompt(job.workflow)
+        if not response or "prompt_id" not in response:
+            raise Exception("Failed to queue prompt or invalid response.")
+
+        prompt_id = response["prompt_id"]
+        # With a ComfyServerPool, the server the prompt was routed to
+        client = self.comfy_client.client_for(prompt_id)
+        if client is None:
+            raise Exception(f"No client owns prompt {prompt_id}.")
+        events = client.subscribe(prompt_id)
+        with self._condition:
+            job.prompt_id, job.client = prompt_id, client
+            cancelled = job.state == JobState.CANCELLED
+        if cancelled:
+            # Cancelled while the prompt was being sent
+            client.delete_queued([prompt_id])
+            self.comfy_client.unsubscribe(prompt_id)
+            return
+        if self._pool_stats is None:
+            self.model_stats.record(
+                self._last_models.get(client), job.model, job.avoided_swap
             )
+            self._last_models[client] = job.model
+        logger.info(f"Job {job.job_id} queued with prompt ID: {prompt_id}")
+        threading.Thread(target=self._run_job, args=(job, events), daemon=True).start()
 
-            # 4. Listen to WebSocket for completion and image
+    def _run_job(self, job: GenerationJob, events: queue.Queue):
+        """Follows a queued job to completion (runs in a thread per job)."""
+        try:
+            # 4. Listen to this prompt's WebSocket events for progress and images
             logger.debug("Listening to WebSocket for generation progress...")
-            while self._is_generating:
-                msg = self.comfy_client.receive_ws_message()
-                if msg is None:
-                    continue
+            try:
+                images = self._wait_for_images(job, events, job.websocket_nodes)
+            finally:
+                self.comfy_client.unsubscribe(job.prompt_id)
 
-                if isinstance(msg, bytes):
-                    self._handle_preview_image(msg)
-                    continue
-
-                if msg["type"] == "progress" and "data" in msg:
-                    data = msg["data"]
-                    self.on_progress_update(data["value"] / data["max"])
-
-                elif msg["type"] == "executed" and "data" in msg:
-                    data = msg["data"]
-                    if data.get("output") and "images" in data.get("output"):
-                        logger.info("Image data received.")
-                        self.on_status_update(
-                            "Downloading...", "Receiving image", "CYAN_200", "CYAN_400"
-                        )
-                        self._handle_image_data(data["output"]["images"])
-                        break
-
-                    if (
-                        data.get("prompt_id") == self._prompt_id
-                        and data.get("node") is None
-                    ):
-                        logger.info("Execution finished for the prompt.")
-                        break
-
-            if not self._is_generating:
+            if job.state == JobState.CANCELLED:
                 logger.warning("Generation was cancelled before completion.")
                 return
 
+            logger.info("Image data received.")
+            with self._condition:
+                job.state = JobState.DOWNLOADING
+                self._condition.notify_all()  # Frees a max_in_flight slot
+                # Leave the progress bar to a job that is still generating
+                report_progress = self._count((JobState.RUNNING,)) == 0
+            self.on_status_update(
+                "Downloading...", "Receiving image", "CYAN_200", "CYAN_400"
+            )
+            results = self._handle_image_data(job, images, report_progress)
+            if job.state == JobState.CANCELLED:
+                logger.warning("Job was cancelled while downloading.")
+                return
+            if job.cache_key and results:
+                self.result_cache.put(job.cache_key, results)
+
             logger.info("Generation finished successfully.")
-            self.on_status_update("Finished", "Ready", "WHITE70", "GREEN_400")
-            self.on_progress_update(1.0)
+            self._complete_job(job)
 
         except Exception as e:
+            if job.state == JobState.CANCELLED:
+                return
             logger.error(f"Generation process failed: {e}", exc_info=True)
+            self._finish_job(job, JobState.FAILED, e)
             self.on_status_update("Error", "Failed", "RED_500", "RED_500")
-        finally:
-            self._is_generating = False
-            self._prompt_id = None
 
-    def _handle_preview_image(self, image_bytes: bytes):
+    def _complete_job(self, job: GenerationJob):
+        """Marks a job finished and shows what is left in the queue."""
+        remaining = self._finish_job(job, JobState.FINISHED)
+        if remaining is None:
+            return  # Cancelled in the meantime
+        if remaining:
+            self.on_status_update(
+                "Generating...", f"{remaining} in queue", "BLUE_200", "ORANGE_400"
+            )
+        else:
+            self.on_status_update("Finished", "Ready", "WHITE70", "GREEN_400")
+            self.on_progress_update(1.0)
+
+    def _finish_job(self, job: GenerationJob, state: str, error=None) -> int | None:
         """
-        Converts the raw image bytes to a base64 string and updates the UI.
+        Records the final state of a job and returns the number of jobs left.
+        Returns None without changing anything if the job has already ended,
+        e.g. because it was cancelled.
         """
-        try:
-            # The first 8 bytes are header info, we need to strip it
-            image_data = image_bytes[8:]
-            img_base64 = base64.b64encode(image_data).decode("utf-8")
-            self.on_preview_update(img_base64)
-            logger.debug("Preview image updated.")
-        except Exception as e:
-            logger.error(f"Failed to handle preview image: {e}", exc_info=True)
-
-    def _handle_image_data(self, images: list):
+        with self._condition:
+            if job.state in JobState.DONE:
+                return None
+            job.state = state
+            if error is not None:
+                job.error = str(error)
+            done = [j.job_id for j in self._jobs.values() if j.state in JobState.DONE]
+            for job_id in done[: max(0, len(done) - MAX_FINISHED_JOBS)]:
+                del self._jobs[job_id]
+            self._condition.notify_all()
+            return len(self._jobs) - self._count(JobState.DONE)
+
+    @staticmethod
+    def _use_websocket_outputs(workflow: dict) -> frozenset[str]:
         """
-        Fetches the last image from the list, converts it to base64,
-        and updates the UI via callback.
+        Replaces the image output nodes with SaveImageWebsocket nodes and
+        returns their ids. Nodes are replaced, not mutated, because they are
+        shared with the workflow template.
         """
-        if not images:
-            logger.warning("No images found in the received data.")
-            return
+        node_ids = []
+        for node_id, node in list(workflow.items()):
+            if node.get("class_type") in IMAGE_OUTPUT_CLASSES:
+                workflow[node_id] = {
+                    **node,
+                    "class_type": WEBSOCKET_OUTPUT_CLASS,
+                    "inputs": {"images": node["inputs"]["images"]},
+                }
+                node_ids.append(node_id)
+        return frozenset(node_ids)
+
+    def _wait_for_images(
+        self,
+        job: GenerationJob,
+        events: queue.Queue,
+        websocket_nodes: frozenset[str] = frozenset(),
+    ) -> list:
+        """
+        Consumes the events routed to the job's prompt until it has finished
+        and returns the images of its last output node: /view image infos, or
+        the image bytes for frames sent by websocket_nodes. Returns early with
+        no images if the job is cancelled.
+        """
+        images = []
+        node = None  # Node currently executing
+        while job.state != JobState.CANCELLED:
+            try:
+                msg = events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            if isinstance(msg, BinaryFrame):
+                if node in websocket_nodes:
+                    images.append(msg.data)
+                else:
+                    self._handle_preview_image(msg)
+                continue
+
+            msg_type = msg.get("type")
+            data = msg.get("data") or {}
+            if msg_type == "progress":
+                self.on_progress_update(data["value"] / data["max"])
+
+            elif msg_type == "executed":
+                output = data.get("output") or {}
+                if output.get("images"):
+                    images = output["images"]
+
+            elif msg_type == "execution_start":
+                with self._condition:
+                    if job.state == JobState.QUEUED:
+                        job.state = JobState.RUNNING
+                self.on_status_update(
+                    "Generating...",
+                    f"ID: {job.prompt_id[:8]}",
+                    "BLUE_200",
+                    "ORANGE_400",
+                )
 
-        image_info = images[-1]
-        filename = image_info["filename"]
-        subfolder = image_info["subfolder"]
-        img_type = image_info["type"]
-        logger.info(f"Handling final image: {filename}")
+            elif msg_type == "executing":
+                node = data.get("node")
+                if node in websocket_nodes:
+                    images = []  # Keep only the last output node's frames
+                if node is None:
+                    logger.info("Execution finished for the prompt.")
+                    break
+
+            elif msg_type == "execution_error":
+                raise Exception(
+                    f"Node {data.get('node_id')} failed: {data.get('exception_message')}"
+                )
 
-        try:
-            image_url = f"{self.comfy_client.api_url}/view?filename={filename}&subfolder={subfolder}&type={img_type}"
-            logger.debug(f"Fetching image from {image_url}")
-            img_response = requests.get(image_url)
-            img_response.raise_for_status()
+            elif msg_type == "execution_interrupted":
+                raise Exception("Execution was interrupted on the server.")
 
-            img_bytes = img_response.content
-            img_base64 = base64.b64encode(img_bytes).decode("utf-8")
+        if job.state != JobState.CANCELLED and not images:
+            # Fully cached prompts finish without "executed" messages
+            images = self._history_images(job.client, job.prompt_id)
+        return images
 
-            logger.info(f"Image '{filename}' received and encoded to base64.")
-            self.on_image_update(img_base64)
+    def _history_images(self, client, prompt_id: str) -> list:
+        history = client.get_history(prompt_id) or {}
+        outputs = history.get(prompt_id, {}).get("outputs", {})
+        images = []
+        for output in outputs.values():
+            images = output.get("images") or images
+        return images
 
+    def _handle_preview_image(self, frame: BinaryFrame):
+        """
+        Hands the preview image of a decoded frame to the UI. The frame data
+        is a view into the received message, not a copy.
+        """
+        try:
+            self.on_preview_update(frame.data)
+            logger.debug(f"Preview image updated ({frame.image_type}).")
         except Exception as e:
-            logger.error(f"Failed to download or encode image: {e}", exc_info=True)
-            self.on_status_update("Error", "Image Fetch Failed", "RED_500", "RED_500")
+            logger.error(f"Failed to handle preview image: {e}", exc_info=True)
+
+    def _handle_image_data(
+        self, job: GenerationJob, images: list, report_progress=True
+    ) -> list:
+        """
+        Streams every image of the output, reporting download progress, and
+        hands the raw image bytes of the last one to the UI via callback and
+        all of them to on_job_complete. Images that arrived over the
+        WebSocket are handed over directly. Raises if the output has no
+        images or any image cannot be fetched, so a job without its full
+        output is never reported as finished.
+        """
+        if not images:
+            raise Exception("The prompt finished without output images.")
+
+        results = []
+        for index, image_info in enumerate(images):
+            if not isinstance(image_info, dict):
+                logger.info(f"Image received over WebSocket ({len(image_info)} bytes).")
+                results.append(image_info)
+                continue
+
+            filename = image_info["filename"]
+            subfolder = image_info["subfolder"]
+            img_type = image_info["type"]
+            logger.info(f"Handling final image: {filename}")
+
+            def on_download_progress(received, total, index=index):
+                if total and report_progress:
+                    self.on_progress_update((index + received / total) / len(images))
+
+            img_bytes = job.client.download_image(
+                filename, subfolder, img_type, on_progress=on_download_progress
+            )
+            if img_bytes is None:
+                raise Exception(f"Could not fetch image '{filename}'.")
+
+            logger.info(f"Image '{filename}' received ({len(img_bytes)} bytes).")
+            results.append(img_bytes)
+            if job.state == JobState.CANCELLED:
+                break
+
+        if job.state == JobState.CANCELLED:
+            return []
+        self._deliver_results(job, results)
+        return results
+
+    def _deliver_results(self, job: GenerationJob, results: list):
+        """Hands the last image to the UI and all of them to on_job_complete."""
+        self.on_image_update(results[-1])
+        if self.on_job_complete:
+            self.on_job_complete(job.job_id, results)
@@ -0,0 +1,48 @@
+# src/services/model_affinity.py
+import threading
+
+# Node "1" (UnetLoaderGGUFAdvanced) of GGUF_WORKFLOW_API.json loads the model
+MODEL_LOADER_NODE_ID = "1"
+
+
+def workflow_model(workflow: dict) -> str | None:
+    """Returns the unet_name a workflow loads, or None if it has no loader."""
+    node = workflow.get(MODEL_LOADER_NODE_ID) or {}
+    model = node.get("inputs", {}).get("unet_name")
+    if model is not None:
+        return model
+    for node in workflow.values():
+        if "unet_name" in node.get("inputs", {}):
+            return node["inputs"]["unet_name"]
+    return None
+
+
+class ModelSwapStats:
+    """
+    Counts model loads caused by scheduling. A swap is a job that runs on a
+    server whose previous job used another model. An avoided swap is a job
+    that the scheduler placed or reordered to follow a job with the same
+    model when plain routing or FIFO order would have caused a swap.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.swaps = 0
+        self.swaps_avoided = 0
+
+    def record(self, previous_model, model, avoided=False):
+        with self._lock:
+            self.jobs += 1
+            if previous_model is not None and previous_model != model:
+                self.swaps += 1
+            if avoided:
+                self.swaps_avoided += 1
+
+    def as_dict(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "jobs": self.jobs,
+                "swaps": self.swaps,
+                "swaps_avoided": self.swaps_avoided,
+            }
@@ -0,0 +1,207 @@
+# src/services/result_cache.py
+import hashlib
+import json
+import os
+import struct
+import threading
+from collections import OrderedDict
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Entry layout: magic, image count, then a u64 length and the bytes of
+# every image, in output order.
+MAGIC = b"MCRESULT"
+_COUNT = struct.Struct("<I")
+_LENGTH = struct.Struct("<Q")
+ENTRY_SUFFIX = ".result"
+
+
+def result_key(workflow: dict, model: str | None) -> str:
+    """
+    Content hash of a fully patched workflow and its model. The workflow is
+    serialized canonically (sorted keys, no whitespace), so equal workflows
+    get equal keys however their dicts were built.
+    """
+    canonical = json.dumps(
+        {"model": model, "workflow": workflow},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Output images on disk, keyed by result_key().
+
+    With a fixed seed the same workflow produces the same images, so a
+    repeat request is answered from here without contacting the server.
+    Entries are evicted least recently used first once the total size
+    exceeds max_bytes; reads touch the file's mtime, so the order survives
+    restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()  # key -> size
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._scan()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_SUFFIX) and entry.is_file():
+                stat = entry.stat()
+                key = entry.name[: -len(ENTRY_SUFFIX)]
+                entries.append((stat.st_mtime_ns, key, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+        self._delete_files(self._evict())
+        logger.info(
+            f"Result cache {self.directory}: {len(self._entries)} entries, "
+            f"{self._size} bytes."
+        )
+
+    def get(self, key: str) -> list[bytes] | None:
+        """Returns the cached images for key, or None on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+        # The file is read without the lock; an entry evicted meanwhile is
+        # simply a miss
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                images = self._decode(f.read())
+            os.utime(path)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Dropping unreadable cache entry {key}: {e}")
+            with self._lock:
+                self.misses += 1
+                dropped = self._drop(key)
+            self._delete_files(dropped)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+        return images
+
+    def put(self, key: str, images: list) -> bool:
+        """Stores images under key. Returns False if they can never fit."""
+        data = self._encode(images)
+        if len(data) > self.max_bytes:
+            return False
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Could not write cache entry {key}: {e}")
+            return False
+        with self._lock:
+            self._size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            evicted = self._evict()
+        self._delete_files(evicted)
+        return True
+
+    def _evict(self) -> list[str]:
+        """
+        Drops least recently used entries from the index until it is within
+        max_bytes, and returns their keys. Called with the lock held; the
+        files are deleted afterwards by _delete_files().
+        """
+        evicted = []
+        while self._size > self.max_bytes:
+            evicted += self._drop(next(iter(self._entries)))
+            self.evictions += 1
+        return evicted
+
+    def _drop(self, key: str) -> list[str]:
+        size = self._entries.pop(key, None)
+        if size is None:
+            return []
+        self._size -= size
+        return [key]
+
+    def _delete_files(self, keys: list[str]):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not delete cache entry {key}: {e}")
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            self._size = 0
+        self._delete_files(keys)
+
+    @staticmethod
+    def _encode(images: list) -> bytes:
+        parts = [MAGIC, _COUNT.pack(len(images))]
+        for image in images:
+            parts.append(_LENGTH.pack(len(image)))
+            parts.append(image)
+        return b"".join(parts)
+
+    @staticmethod
+    def _decode(data: bytes) -> list[bytes]:
+        if not data.startswith(MAGIC):
+            raise ValueError("bad magic")
+        offset = len(MAGIC)
+        (count,) = _COUNT.unpack_from(data, offset)
+        offset += _COUNT.size
+        images = []
+        for _ in range(count):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            if offset + length > len(data):
+                raise ValueError("truncated entry")
+            images.append(data[offset : offset + length])
+            offset += length
+        return images
+
+    def as_dict(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+
+def open_result_cache(directory: str, **options) -> ResultCache | None:
+    """
+    Opens the result cache in directory. Returns None, so generation runs
+    without a cache, when the directory cannot be created or read.
+    """
+    try:
+        return ResultCache(directory, **options)
+    except OSError as e:
+        logger.warning(
+            f"Running without a result cache, could not open {directory}: {e}"
+        )
+        return None
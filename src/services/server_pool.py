@@ -0,0 +1,293 @@
+# src/services/server_pool.py
+import threading
+import time
+from services.client import ComfyUIClient
+from services.model_affinity import ModelSwapStats, workflow_model
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ServerState:
+    """Load and health bookkeeping for one ComfyUI server in the pool."""
+
+    def __init__(self, client: ComfyUIClient):
+        self.client = client
+        self.queue_depth = 0  # Running + pending prompts on the server
+        self.latency = None  # Moving average of prompt duration (seconds)
+        self.healthy = False
+        self.failures = 0
+        self.retry_at = 0.0
+        # Model of the last prompt routed here, i.e. the one loaded once the
+        # server's queue drains
+        self.model = None
+        # Our unfinished prompts -> when they were queued or started running
+        self.started_at: dict[str, float] = {}
+
+    @property
+    def api_url(self):
+        return self.client.api_url
+
+    def load(self, default_latency: float, model=None, swap_cost=0.0) -> float:
+        """
+        Expected wait for a new prompt: queued work times the job latency,
+        plus swap_cost if the server would have to replace its loaded model.
+        A server with no model loaded yet pays the load either way.
+        """
+        latency = self.latency if self.latency is not None else default_latency
+        wait = (self.queue_depth + 1) * latency
+        if model is not None and self.model is not None and self.model != model:
+            wait += swap_cost
+        return wait
+
+
+class ComfyServerPool:
+    """
+    Spreads prompts over several ComfyUI servers.
+
+    Exposes the ComfyUIClient methods GenerationService needs, so it can be
+    used as its comfy_client. Each queue_prompt() goes to the healthy server
+    with the lowest expected wait: its queue depth, taken from /queue and the
+    WebSocket "status" messages, times its recent job latency. Servers that
+    fail to connect, queue or report are ejected and retried in the
+    background with exponential backoff.
+
+    Loading another GGUF model costs tens of seconds, so servers that would
+    have to swap models are charged model_swap_cost extra seconds. Jobs for
+    the same model therefore stick to the server that last ran it unless
+    that server is busier by more than a model load.
+    """
+
+    def __init__(
+        self,
+        api_urls: list[str],
+        refresh_interval=5.0,
+        retry_delay=5.0,
+        max_retry_delay=120.0,
+        latency_smoothing=0.3,
+        model_swap_cost=30.0,
+        **client_options,
+    ):
+        self._servers = [
+            ServerState(ComfyUIClient(api_url, **client_options))
+            for api_url in api_urls
+        ]
+        self.refresh_interval = refresh_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.latency_smoothing = latency_smoothing
+        self.model_swap_cost = model_swap_cost
+        self.model_stats = ModelSwapStats()
+        self._lock = threading.Lock()
+        self._owners: dict[str, ServerState] = {}  # prompt_id -> server
+        self._closed = threading.Event()
+        self._monitor = None
+        for server in self._servers:
+            server.client.add_listener(self._make_listener(server))
+        logger.info(f"ComfyServerPool initialized with {len(self._servers)} servers.")
+
+    @property
+    def servers(self) -> list[ServerState]:
+        return list(self._servers)
+
+    def connect(self):
+        """
+        Connects every server and starts the background monitor. Returns True
+        if at least one server is usable.
+        """
+        for server in self._servers:
+            self._try_connect(server)
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._run_monitor, daemon=True)
+            self._monitor.start()
+        return self.is_connected()
+
+    def is_connected(self):
+        return any(server.healthy for server in self._servers)
+
+    def client_for(self, prompt_id) -> ComfyUIClient | None:
+        """
+        Returns the client of the server that prompt_id was sent to, or None
+        if the prompt is unknown or was already unsubscribed.
+        """
+        with self._lock:
+            server = self._owners.get(prompt_id)
+        return server.client if server is not None else None
+
+    def queue_prompt(self, prompt_workflow, avoided_swap=False):
+        """
+        Queues a prompt on the least-loaded healthy server, falling back to
+        the next one if it fails. Returns the /prompt response, or None if no
+        server accepted the prompt. avoided_swap tells model_stats that the
+        caller already reordered this prompt to avoid a model swap.
+        """
+        model = workflow_model(prompt_workflow)
+        tried = set()
+        while True:
+            server, avoided = self._pick_server(model, exclude=tried)
+            if server is None:
+                logger.error("No healthy ComfyUI server available.")
+                return None
+            tried.add(id(server))
+            response = server.client.queue_prompt(prompt_workflow)
+            if response and "prompt_id" in response:
+                prompt_id = response["prompt_id"]
+                with self._lock:
+                    self._owners[prompt_id] = server
+                    server.started_at[prompt_id] = time.monotonic()
+                    server.queue_depth += 1
+                    previous_model, server.model = server.model, model
+                self.model_stats.record(previous_model, model, avoided or avoided_swap)
+                logger.info(f"Prompt {prompt_id} routed to {server.api_url}")
+                return response
+            self._eject(server, "queue_prompt failed")
+
+    def subscribe(self, prompt_id):
+        client = self.client_for(prompt_id)
+        if client is None:
+            raise KeyError(f"Unknown prompt_id: {prompt_id}")
+        return client.subscribe(prompt_id)
+
+    def unsubscribe(self, prompt_id):
+        """
+        Stops routing messages for prompt_id and forgets its server. The
+        prompt no longer counts towards the server's latency, even if its
+        finish message was lost.
+        """
+        with self._lock:
+            server = self._owners.pop(prompt_id, None)
+            if server is None:
+                return
+            server.started_at.pop(prompt_id, None)
+        server.client.unsubscribe(prompt_id)
+
+    def get_history(self, prompt_id):
+        client = self.client_for(prompt_id)
+        return client.get_history(prompt_id) if client is not None else None
+
+    def interrupt_generation(self):
+        """Interrupts the running prompt on every server running one of ours."""
+        for server in self._servers:
+            if server.healthy and server.started_at:
+                server.client.interrupt_generation()
+
+    def refresh(self):
+        """Polls /queue on every healthy server to update its queue depth."""
+        for server in self._servers:
+            if not server.healthy:
+                continue
+            server_queue = server.client.get_queue()
+            if server_queue is None:
+                self._eject(server, "/queue failed")
+                continue
+            depth = len(server_queue.get("queue_running", [])) + len(
+                server_queue.get("queue_pending", [])
+            )
+            with self._lock:
+                server.queue_depth = depth
+
+    def close(self):
+        self._closed.set()
+        for server in self._servers:
+            server.client.close()
+            server.healthy = False
+
+    def _default_latency(self) -> float:
+        latencies = [s.latency for s in self._servers if s.latency is not None]
+        return sum(latencies) / len(latencies) if latencies else 1.0
+
+    def _pick_server(self, model, exclude=()) -> tuple[ServerState | None, bool]:
+        """
+        Returns the healthy server with the lowest expected wait for a prompt
+        using model, and whether picking it avoided a model swap that the
+        least-loaded server would have needed.
+        """
+        with self._lock:
+            default_latency = self._default_latency()
+            candidates = [
+                server
+                for server in self._servers
+                if server.healthy
+                and server.client.is_connected()
+                and id(server) not in exclude
+            ]
+            if not candidates:
+                return None, False
+            best = min(
+                candidates,
+                key=lambda s: s.load(default_latency, model, self.model_swap_cost),
+            )
+            least_loaded = min(candidates, key=lambda s: s.load(default_latency))
+            avoided = (
+                model is not None
+                and best.model == model
+                and least_loaded.model not in (None, model)
+            )
+            return best, avoided
+
+    def _try_connect(self, server: ServerState) -> bool:
+        if server.client.is_connected() or server.client.connect():
+            server.healthy = True
+            server.failures = 0
+            logger.info(f"ComfyUI server {server.api_url} is healthy.")
+            return True
+        self._eject(server, "connect failed")
+        return False
+
+    def _eject(self, server: ServerState, reason: str):
+        server.healthy = False
+        server.failures += 1
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (server.failures - 1))
+        server.retry_at = time.monotonic() + delay
+        logger.warning(
+            f"Ejected ComfyUI server {server.api_url} ({reason}); retrying in {delay:.0f}s."
+        )
+
+    def _run_monitor(self):
+        while not self._closed.wait(self.refresh_interval):
+            try:
+                now = time.monotonic()
+                for server in self._servers:
+                    if server.healthy and not server.client.is_connected():
+                        # The client reconnects on its own; stop routing to it
+                        self._eject(server, "WebSocket disconnected")
+                    elif not server.healthy and now >= server.retry_at:
+                        self._try_connect(server)
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Server pool monitor failed: {e}", exc_info=True)
+
+    def _make_listener(self, server: ServerState):
+        def on_message(message):
+            if not isinstance(message, dict):
+                return
+            msg_type = message.get("type")
+            data = message.get("data") or {}
+            if msg_type == "status":
+                exec_info = (data.get("status") or {}).get("exec_info") or {}
+                if "queue_remaining" in exec_info:
+                    with self._lock:
+                        server.queue_depth = exec_info["queue_remaining"]
+            elif msg_type == "execution_start":
+                with self._lock:
+                    if data.get("prompt_id") in server.started_at:
+                        # Measure execution time, not time spent queued
+                        server.started_at[data["prompt_id"]] = time.monotonic()
+            elif msg_type in ("executing", "execution_error", "execution_interrupted"):
+                if msg_type == "executing" and data.get("node") is not None:
+                    return
+                self._finish(server, data.get("prompt_id"))
+
+        return on_message
+
+    def _finish(self, server: ServerState, prompt_id):
+        with self._lock:
+            started_at = server.started_at.pop(prompt_id, None)
+            if started_at is None:
+                return
+            elapsed = time.monotonic() - started_at
+            if server.latency is None:
+                server.latency = elapsed
+            else:
+                alpha = self.latency_smoothing
+                server.latency += alpha * (elapsed - server.latency)
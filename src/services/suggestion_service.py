@@ -0,0 +1,105 @@
+# src/services/suggestion_service.py
+import threading
+import time
+from typing import Callable
+from utils.autocomplete import TagAutocomplete
+from utils.data import TAG_LOADER
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class SuggestionService:
+    """
+    Computes tag suggestions off the UI event path.
+
+    Keystrokes are handed to submit(), which only records the latest text.
+    A single worker thread waits until the text has been stable for the
+    debounce interval, runs the lookup and publishes the result through
+    on_result(text, matches). Results for text that was superseded while the
+    lookup ran are dropped, so fast typing never queues up searches or redraws.
+    """
+
+    def __init__(
+        self,
+        on_result: Callable[[str, list[str]], None],
+        debounce: float = 0.12,
+        limit: int = 10,
+        categories=None,
+    ):
+        self.on_result = on_result
+        self.debounce = debounce
+        self._limit = limit
+        self._categories = categories
+        self._autocomplete = None  # Created once the tag index has loaded
+        self._condition = threading.Condition()
+        self._text = None
+        self._submitted_at = 0.0
+        self._generation = 0
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+        logger.info("SuggestionService initialized.")
+
+    def submit(self, text: str):
+        """Schedules suggestions for text, replacing any pending request."""
+        with self._condition:
+            self._text = text
+            self._submitted_at = time.monotonic()
+            self._generation += 1
+            self._condition.notify()
+
+    def close(self):
+        """Stops the worker thread; pending requests are dropped."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _next_request(self) -> tuple[int, str] | None:
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                if self._text is None:
+                    self._condition.wait()
+                    continue
+                remaining = self._submitted_at + self.debounce - time.monotonic()
+                if remaining > 0:
+                    # Typing continues; wait until the text settles
+                    self._condition.wait(remaining)
+                    continue
+                text, self._text = self._text, None
+                return self._generation, text
+
+    def _is_current(self, generation: int) -> bool:
+        with self._condition:
+            return generation == self._generation
+
+    def _suggest(self, text: str) -> list[str]:
+        if not text.strip():
+            return []
+        if self._autocomplete is None:
+            # The first query waits for the background loader to finish
+            tag_index = TAG_LOADER.get()
+            if tag_index is None:
+                return []
+            self._autocomplete = TagAutocomplete(
+                tag_index, limit=self._limit, categories=self._categories
+            )
+        return self._autocomplete.suggest(text)
+
+    def _run(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                logger.debug("Suggestion worker stopped.")
+                return
+            generation, text = request
+            try:
+                matches = self._suggest(text)
+                if not self._is_current(generation):
+                    logger.debug(f"Dropping stale suggestions for '{text}'")
+                    continue
+                self.on_result(text, matches)
+            except Exception as e:
+                logger.error(f"Suggestion worker failed: {e}", exc_info=True)
@@ -1,6 +1,5 @@
 import time
 import json
-import requests
 import os
 from services.client import ComfyUIClient
 
@@ -17,6 +16,8 @@ def main():
         return
 
     print("Connected to ComfyUI.")
+    # Start keeping messages before queuing so none of the prompt's are missed
+    comfy_client.listen_all()
 
     # Load a sample ComfyUI workflow (replace with your actual workflow JSON)
     try:
@@ -45,6 +46,8 @@ def main():
             # Listen to WebSocket for real-time updates
             while True:
                 ws_message = comfy_client.receive_ws_message()
+                if ws_message is not None and not isinstance(ws_message, dict):
+                    continue  # Skip binary preview frames
                 if ws_message:
                     # print(f"WS Message: {json.dumps(ws_message, indent=2)}") # Uncomment for debugging
                     if ws_message["type"] == "progress":
@@ -60,12 +63,14 @@ def main():
                             print("Image data found in WebSocket message.")
                             for image_data in data["output"]["images"]:
                                 try:
-                                    # For "Preview Image" nodes, the image data is sent directly
-                                    image_url = f"{comfy_client.api_url}/view?filename={image_data['filename']}&subfolder={image_data['subfolder']}&type={image_data['type']}"
-                                    print(f"Fetching image from: {image_url}")
-
-                                    img_response = requests.get(image_url)
-                                    img_response.raise_for_status()
+                                    print(f"Fetching image: {image_data['filename']}")
+                                    img_bytes = comfy_client.get_image(
+                                        image_data["filename"],
+                                        image_data["subfolder"],
+                                        image_data["type"],
+                                    )
+                                    if img_bytes is None:
+                                        continue
 
                                     # Ensure the storage/temp directory exists
                                     output_dir = "storage/temp"
@@ -75,12 +80,10 @@ def main():
                                     )
 
                                     with open(output_path, "wb") as img_file:
-                                        img_file.write(img_response.content)
+                                        img_file.write(img_bytes)
 
                                     print(f"Image saved to: {output_path}")
 
-                                except requests.exceptions.RequestException as e:
-                                    print(f"Error fetching image: {e}")
                                 except Exception as e:
                                     print(f"An error occurred: {e}")
 
@@ -101,7 +104,7 @@ def main():
         print("Failed to queue prompt.")
 
     # Close the WebSocket connection
-    comfy_client.close_ws_connection()
+    comfy_client.close()
     print("Disconnected from ComfyUI.")
 
 
@@ -0,0 +1,76 @@
+# src/utils/autocomplete.py
+from utils.logger import get_logger
+from utils.tag_index import TOP_K, TagIndex
+
+logger = get_logger(__name__)
+
+
+class TagAutocomplete:
+    """
+    Suggests tags for the comma-separated token being typed in a prompt.
+
+    Remembers the key ranges matched by the previous query. When the user keeps
+    typing the same token (lo -> lon -> long), the new prefix can only match a
+    subset of those ranges, so the lookup is narrowed to them instead of
+    searching the whole dictionary again. Deleting characters or starting a
+    new token falls back to a full lookup.
+    """
+
+    def __init__(self, tag_index: TagIndex, limit: int = TOP_K, categories=None):
+        self._index = tag_index
+        self._limit = limit
+        # Category names or numbers to suggest from; None means all of them
+        self._categories = tag_index.category_ids(categories)
+        self.reset()
+
+    def reset(self):
+        self._token = -1
+        self._word = ""
+        self._ranges = None
+        # Prefix matches for the last word, and what was actually suggested
+        # (which falls back to fuzzy matches when there were no prefix matches)
+        self._prefix_matches: list[str] = []
+        self._matches: list[str] = []
+
+    @staticmethod
+    def current_word(text: str) -> tuple[int, str]:
+        """Returns the position and normalized text of the last token."""
+        parts = text.split(",")
+        return len(parts) - 1, parts[-1].strip().lower()
+
+    def suggest(self, text: str) -> list[str]:
+        """Returns suggestions for the last comma-separated token of text."""
+        token, word = self.current_word(text)
+        if not word:
+            self.reset()
+            return []
+
+        if token == self._token and word == self._word:
+            return self._matches
+
+        extends_previous = (
+            token == self._token
+            and self._ranges is not None
+            and word.startswith(self._word)
+        )
+        ranges = self._index.ranges(word, self._ranges if extends_previous else None)
+        if extends_previous and ranges == self._ranges:
+            # Every tag under the old prefix also matches the new one
+            prefix_matches = self._prefix_matches
+        else:
+            names = self._index.store.names
+            prefix_matches = [
+                names[i]
+                for i in self._index.top_ids(
+                    word, self._limit, ranges, self._categories
+                )
+            ]
+        matches = prefix_matches
+        if not matches:
+            # Nothing starts with the word; it may be a typo
+            matches = self._index.fuzzy_search(word, self._limit, self._categories)
+
+        self._token, self._word, self._ranges = token, word, ranges
+        self._prefix_matches = prefix_matches
+        self._matches = matches
+        return matches
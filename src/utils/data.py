@@ -1,18 +1,27 @@
 # src/utils/data.py
 import csv
 import os
+import threading
 from utils.logger import get_logger
+from utils.tag_db import is_tag_db_fresh, open_tag_db, write_tag_db
+from utils.tag_index import TagIndex, TagStore
 
 logger = get_logger(__name__)
 
 IMAGE_SRC = "https://picsum.photos/1080/1920"
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), "..", "assets")
+DANBOORU_CSV_PATH = os.path.join(ASSETS_DIR, "danbooru.csv")
+# Packed tag database generated from danbooru.csv on first run
+DANBOORU_DB_PATH = os.path.join(ASSETS_DIR, "danbooru.tagdb")
+WORKFLOW_TEMPLATE_PATH = os.path.join(ASSETS_DIR, "GGUF_WORKFLOW_API.json")
+# Images of finished workflows, reused for identical repeat requests. Kept
+# in the writable storage directory next to the config, not in assets
+RESULT_CACHE_DIR = os.path.join("storage", "data", "result_cache")
 
 
-def load_danbooru_tags(limit=100000):
-    """Loads tags from the danbooru.csv file."""
-    tags = []
-    # Updated path to storage/data/danbooru.csv
-    file_path = os.path.join(os.path.dirname(__file__), "..", "assets", "danbooru.csv")
+def load_danbooru_tags(limit=100000, file_path=DANBOORU_CSV_PATH) -> TagStore:
+    """Loads tags, categories, post counts and aliases from the danbooru.csv file."""
+    rows = []
     logger.info(f"Loading danbooru tags from {file_path}")
     try:
         with open(file_path, "r", encoding="utf-8") as f:
@@ -21,15 +30,81 @@ def load_danbooru_tags(limit=100000):
                 if i >= limit:
                     break
                 if row:
-                    # Assuming the tag is in the first column
-                    tags.append(row[0])
-        logger.info(f"Loaded {len(tags)} tags.")
+                    # Columns: tag, category, post count, aliases
+                    category = int(row[1]) if len(row) > 1 and row[1] else 0
+                    count = int(row[2]) if len(row) > 2 and row[2] else 0
+                    aliases = row[3].split(",") if len(row) > 3 and row[3] else []
+                    rows.append((row[0], category, count, aliases))
+        logger.info(f"Loaded {len(rows)} tags.")
     except FileNotFoundError:
         logger.error(
             f"Error: {file_path} not found. Please check the directory structure.",
             exc_info=True,
         )
-    return tags
+    return TagStore.from_rows(rows)
 
 
-ALL_PROMPTS = load_danbooru_tags()
+def load_tag_index(csv_path=DANBOORU_CSV_PATH, db_path=DANBOORU_DB_PATH) -> TagIndex:
+    """
+    Opens the memory-mapped tag database, regenerating it from the CSV first
+    if it is missing or older than the CSV. Falls back to an in-memory index
+    when the database cannot be written.
+    """
+    if is_tag_db_fresh(db_path, csv_path):
+        try:
+            return open_tag_db(db_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not open tag database {db_path}: {e}")
+
+    logger.info(f"Building tag database from {csv_path}")
+    index = TagIndex.build(load_danbooru_tags(file_path=csv_path))
+    try:
+        write_tag_db(index, db_path, csv_path)
+        return open_tag_db(db_path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Using in-memory tag index, could not write {db_path}: {e}")
+        return index
+
+
+class TagLoader:
+    """
+    Loads the tag index on a background thread.
+    Call start() early so the dictionary is ready by the time the user types;
+    get() blocks until loading has finished (starting it if needed).
+    """
+
+    def __init__(self, load=load_tag_index):
+        self._load = load
+        self._index: TagIndex | None = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                logger.debug("Starting background tag loading.")
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+
+    def _worker(self):
+        try:
+            self._index = self._load()
+        except Exception as e:
+            logger.error(f"Failed to load tag index: {e}", exc_info=True)
+        finally:
+            self._ready.set()
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def get(self, timeout: float | None = None) -> TagIndex | None:
+        """Returns the loaded index, or None if loading failed or timed out."""
+        self.start()
+        if not self._ready.wait(timeout):
+            logger.warning("Timed out waiting for the tag index.")
+            return None
+        return self._index
+
+
+TAG_LOADER = TagLoader()
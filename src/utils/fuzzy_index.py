@@ -0,0 +1,163 @@
+# src/utils/fuzzy_index.py
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable, Sequence
+
+# Words shorter than this have too few trigrams for a useful fuzzy match
+MIN_FUZZY_LEN = 4
+# Number of best trigram-overlap candidates verified with edit distance
+MAX_VERIFIED = 64
+
+
+def trigrams(key: str) -> set[str]:
+    """Returns the trigrams of a key padded with "$" on both ends."""
+    padded = f"${key}$"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edits(word: str) -> int:
+    """Edits tolerated for a query word; longer words may carry more typos."""
+    return 1 if len(word) < 7 else 2
+
+
+def bounded_edit_distance(a: str, b: str, bound: int) -> int:
+    """
+    Edit distance between a and b counting insertions, deletions,
+    substitutions and adjacent transpositions (optimal string alignment).
+    Only the diagonal band of width 2 * bound + 1 is computed, and the search
+    gives up as soon as the distance is known to exceed bound, in which case
+    bound + 1 is returned.
+    """
+    n, m = len(a), len(b)
+    limit = bound + 1
+    if abs(n - m) > bound:
+        return limit
+    before = None
+    previous = [j if j <= bound else limit for j in range(m + 1)]
+    for i in range(1, n + 1):
+        ca = a[i - 1]
+        current = [limit] * (m + 1)
+        if i <= bound:
+            current[0] = i
+        row_min = current[0]
+        for j in range(max(1, i - bound), min(m, i + bound) + 1):
+            cb = b[j - 1]
+            cost = previous[j - 1] + (ca != cb)
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            if before and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current[j] = min(cost, limit)
+            row_min = min(row_min, current[j])
+        if row_min > bound:
+            return limit
+        before, previous = previous, current
+    return previous[m]
+
+
+class TrigramIndex:
+    """
+    Inverted index from trigrams to tag ids for typo-tolerant lookup.
+
+    Each trigram owns a posting list of tag ids in ascending order (i.e. by
+    popularity). A single edit touches at most four trigrams, so a tag within
+    d edits of the query shares at least T - 4d of the query's T trigrams.
+    Counting posting-list hits therefore narrows the 100k tags down to a
+    handful that are then checked with a bounded edit distance.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        gram_keys: Sequence[str],
+        gram_offsets: Sequence[int],
+        gram_ids: Sequence[int],
+    ):
+        self._names = names
+        self._gram_keys = gram_keys
+        # Postings of gram_keys[i] are gram_ids[gram_offsets[i]:gram_offsets[i + 1]]
+        self._gram_offsets = gram_offsets
+        self._gram_ids = gram_ids
+
+    @classmethod
+    def build(cls, names: Sequence[str]) -> "TrigramIndex":
+        postings: dict[str, array] = {}
+        for tag_id, name in enumerate(names):
+            for gram in trigrams(name.lower()):
+                ids = postings.get(gram)
+                if ids is None:
+                    ids = postings[gram] = array("I")
+                ids.append(tag_id)
+        gram_keys = sorted(postings)
+        gram_offsets = array("I", [0])
+        gram_ids = array("I")
+        for gram in gram_keys:
+            gram_ids.extend(postings[gram])
+            gram_offsets.append(len(gram_ids))
+        return cls(names, gram_keys, gram_offsets, gram_ids)
+
+    def columns(self) -> dict[str, Sequence]:
+        """Returns the index columns, keyed like the TrigramIndex constructor."""
+        return {
+            "gram_keys": self._gram_keys,
+            "gram_offsets": self._gram_offsets,
+            "gram_ids": self._gram_ids,
+        }
+
+    def _postings(self, gram: str) -> Sequence[int]:
+        i = bisect_left(self._gram_keys, gram)
+        if i == len(self._gram_keys) or self._gram_keys[i] != gram:
+            return ()
+        return self._gram_ids[self._gram_offsets[i] : self._gram_offsets[i + 1]]
+
+    def search_ids(
+        self,
+        word: str,
+        k: int | None = 10,
+        accept: Callable[[int], bool] | None = None,
+    ) -> list[int]:
+        """
+        Returns up to k tag ids (all verified matches if k is None) within
+        max_edits(word) of the word, closest first and most popular first
+        among equally close tags. accept(tag_id), if given, restricts the
+        candidates before the MAX_VERIFIED cut, e.g. to some categories.
+        """
+        word = word.lower()
+        if len(word) < MIN_FUZZY_LEN:
+            return []
+        bound = max_edits(word)
+        grams = trigrams(word)
+        hits = Counter()
+        for gram in grams:
+            hits.update(self._postings(gram))
+        threshold = max(1, len(grams) - 4 * bound)
+
+        names = self._names
+        length = len(word)
+        # Tags whose length alone rules them out must not take the place of
+        # real matches among the verified candidates
+        candidates = [
+            (count, tag_id)
+            for tag_id, count in hits.items()
+            if count >= threshold
+            and abs(len(names[tag_id]) - length) <= bound
+            and (accept is None or accept(tag_id))
+        ]
+        # Most shared trigrams first, then most popular (lowest id), so the
+        # cut does not depend on the iteration order of the trigram set
+        best = heapq.nsmallest(
+            MAX_VERIFIED,
+            candidates,
+            key=lambda candidate: (-candidate[0], candidate[1]),
+        )
+        matches = []
+        for _, tag_id in best:
+            distance = bounded_edit_distance(word, names[tag_id].lower(), bound)
+            if distance <= bound:
+                matches.append((distance, tag_id))
+        matches.sort()
+        return [tag_id for _, tag_id in matches[:k]]
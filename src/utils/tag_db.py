@@ -0,0 +1,217 @@
+# src/utils/tag_db.py
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Sequence
+from utils.fuzzy_index import TrigramIndex
+from utils.logger import get_logger
+from utils.tag_index import TAG_CATEGORIES, CategoryIndex, TagIndex, TagStore
+
+logger = get_logger(__name__)
+
+# Packed, memory-mapped tag database.
+#
+# Layout: a fixed header, a table of (offset, length) pairs for each section
+# in SECTIONS, then the sections themselves aligned to 8 bytes. String
+# columns are stored as a utf-8 blob plus an array of n + 1 offsets; every
+# other section is a raw array in native byte order.
+MAGIC = b"MCTAGDB\0"
+VERSION = 3
+# magic, version, byte order, source size, source mtime (ns)
+_HEADER = struct.Struct("<8sHcxxxxxQQ")
+_SECTION = struct.Struct("<QQ")
+_ALIGN = 8
+
+SECTIONS = (
+    ("names", "B"),
+    ("name_offsets", "I"),
+    ("categories", "B"),
+    ("counts", "I"),
+    ("keys", "B"),
+    ("key_offsets", "I"),
+    ("ids", "I"),
+    ("alias_keys", "B"),
+    ("alias_key_offsets", "I"),
+    ("alias_ids", "I"),
+    ("top_keys", "B"),
+    ("top_key_offsets", "I"),
+    ("top_ids", "I"),
+    ("gram_keys", "B"),
+    ("gram_key_offsets", "I"),
+    ("gram_offsets", "I"),
+    ("gram_ids", "I"),
+)
+_CATEGORY_COLUMNS = ("positions", "ids", "alias_positions", "alias_ids", "top_ids")
+SECTIONS += tuple(
+    (f"category_{category}_{column}", "I")
+    for category in TAG_CATEGORIES.values()
+    for column in _CATEGORY_COLUMNS
+)
+_BYTE_ORDER = b"l" if sys.byteorder == "little" else b"b"
+
+
+class StringColumn:
+    """Read-only sequence of strings decoded on access from a utf-8 blob."""
+
+    __slots__ = ("_blob", "_offsets")
+
+    def __init__(self, blob: memoryview, offsets: memoryview):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string column index out of range")
+        return str(self._blob[self._offsets[i] : self._offsets[i + 1]], "utf-8")
+
+
+def _pack_strings(strings: Sequence[str]) -> tuple[bytes, array]:
+    offsets = array("I", [0])
+    chunks = []
+    position = 0
+    for s in strings:
+        encoded = s.encode("utf-8")
+        chunks.append(encoded)
+        position += len(encoded)
+        offsets.append(position)
+    return b"".join(chunks), offsets
+
+
+def _source_signature(source_path: str) -> tuple[int, int]:
+    stat = os.stat(source_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def write_tag_db(index: TagIndex, db_path: str, source_path: str):
+    """
+    Serializes an in-memory TagIndex to db_path, stamped with the size and
+    mtime of source_path for staleness checks. The file is written to a
+    temporary path and renamed so readers never see a partial database.
+    """
+    store = index.store
+    columns = index.columns()
+    names, name_offsets = _pack_strings(store.names)
+    keys, key_offsets = _pack_strings(columns["keys"])
+    alias_keys, alias_key_offsets = _pack_strings(columns["alias_keys"])
+    top_keys, top_key_offsets = _pack_strings(columns["top_keys"])
+    gram_columns = index.fuzzy.columns()
+    gram_keys, gram_key_offsets = _pack_strings(gram_columns["gram_keys"])
+    payloads = {
+        "names": names,
+        "name_offsets": name_offsets,
+        "categories": array("B", store.categories),
+        "counts": array("I", store.counts),
+        "keys": keys,
+        "key_offsets": key_offsets,
+        "ids": array("I", columns["ids"]),
+        "alias_keys": alias_keys,
+        "alias_key_offsets": alias_key_offsets,
+        "alias_ids": array("I", columns["alias_ids"]),
+        "top_keys": top_keys,
+        "top_key_offsets": top_key_offsets,
+        "top_ids": array("I", columns["top_ids"]),
+        "gram_keys": gram_keys,
+        "gram_key_offsets": gram_key_offsets,
+        "gram_offsets": array("I", gram_columns["gram_offsets"]),
+        "gram_ids": array("I", gram_columns["gram_ids"]),
+    }
+    for category in TAG_CATEGORIES.values():
+        category_index = index.categories.get(category) or CategoryIndex.empty()
+        for column, values in category_index.columns().items():
+            payloads[f"category_{category}_{column}"] = array("I", values)
+
+    source_size, source_mtime = _source_signature(source_path)
+    header = _HEADER.pack(MAGIC, VERSION, _BYTE_ORDER, source_size, source_mtime)
+    position = _HEADER.size + _SECTION.size * len(SECTIONS)
+    table = []
+    blobs = []
+    for name, _ in SECTIONS:
+        payload = payloads[name]
+        data = payload.tobytes() if isinstance(payload, array) else payload
+        padding = -position % _ALIGN
+        position += padding
+        table.append(_SECTION.pack(position, len(data)))
+        blobs.append(b"\0" * padding)
+        blobs.append(data)
+        position += len(data)
+
+    tmp_path = f"{db_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.writelines(table)
+        f.writelines(blobs)
+    os.replace(tmp_path, db_path)
+    logger.info(f"Wrote tag database to {db_path} ({position} bytes).")
+
+
+def is_tag_db_fresh(db_path: str, source_path: str) -> bool:
+    """Checks that db_path exists and was built from the current source file."""
+    try:
+        with open(db_path, "rb") as f:
+            header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return False
+        magic, version, byte_order, size, mtime = _HEADER.unpack(header)
+        return (
+            magic == MAGIC
+            and version == VERSION
+            and byte_order == _BYTE_ORDER
+            and (size, mtime) == _source_signature(source_path)
+        )
+    except OSError:
+        return False
+
+
+def open_tag_db(db_path: str) -> TagIndex:
+    """
+    Memory-maps a tag database and returns a TagIndex whose columns are views
+    into the mapping, so pages are only read from disk when a lookup touches
+    them.
+    """
+    with open(db_path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+    sections = {}
+    position = _HEADER.size
+    for name, typecode in SECTIONS:
+        offset, length = _SECTION.unpack_from(view, position)
+        position += _SECTION.size
+        sections[name] = view[offset : offset + length].cast(typecode)
+
+    store = TagStore(
+        names=StringColumn(sections["names"], sections["name_offsets"]),
+        categories=sections["categories"],
+        counts=sections["counts"],
+    )
+    logger.info(f"Opened tag database {db_path} with {len(store)} tags.")
+    return TagIndex(
+        store,
+        keys=StringColumn(sections["keys"], sections["key_offsets"]),
+        ids=sections["ids"],
+        alias_keys=StringColumn(sections["alias_keys"], sections["alias_key_offsets"]),
+        alias_ids=sections["alias_ids"],
+        top_keys=StringColumn(sections["top_keys"], sections["top_key_offsets"]),
+        top_ids=sections["top_ids"],
+        fuzzy=TrigramIndex(
+            store.names,
+            gram_keys=StringColumn(sections["gram_keys"], sections["gram_key_offsets"]),
+            gram_offsets=sections["gram_offsets"],
+            gram_ids=sections["gram_ids"],
+        ),
+        categories={
+            category: CategoryIndex(
+                **{
+                    column: sections[f"category_{category}_{column}"]
+                    for column in _CATEGORY_COLUMNS
+                }
+            )
+            for category in TAG_CATEGORIES.values()
+        },
+    )
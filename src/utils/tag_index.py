@@ -0,0 +1,407 @@
+# src/utils/tag_index.py
+import heapq
+from itertools import islice
+from array import array
+from bisect import bisect_left
+from typing import Sequence
+from utils.fuzzy_index import TrigramIndex
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Prefixes up to this length get their top-k list precomputed at build time
+TOP_PREFIX_LEN = 2
+TOP_K = 10
+# Pads precomputed top-k lists that have fewer than TOP_K entries
+NO_TAG = 0xFFFFFFFF
+# Danbooru tag categories (second column of danbooru.csv)
+TAG_CATEGORIES = {
+    "general": 0,
+    "artist": 1,
+    "copyright": 3,
+    "character": 4,
+    "meta": 5,
+}
+# Sorts after every character that can follow a prefix
+_PREFIX_END = "\uffff"
+
+
+class TagStore:
+    """
+    Columnar storage for the danbooru tags.
+    Tags are kept sorted by post count (most popular first), so a tag id
+    doubles as its popularity rank. Aliases are stored as a parallel pair of
+    columns mapping each alias to the id of its canonical tag.
+
+    Columns only need to be indexable sequences, so they can be plain lists
+    and arrays or views into a memory-mapped tag database.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        categories: Sequence[int],
+        counts: Sequence[int],
+        alias_names: Sequence[str] = (),
+        alias_targets: Sequence[int] = (),
+    ):
+        self.names = names
+        self.categories = categories
+        self.counts = counts
+        self.alias_names = alias_names
+        self.alias_targets = alias_targets
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple[str, int, int, list[str]]]) -> "TagStore":
+        """Builds a store from (name, category, count, aliases) rows."""
+        rows = sorted(rows, key=lambda row: -row[2])
+        alias_names = []
+        alias_targets = array("I")
+        for tag_id, row in enumerate(rows):
+            for alias in row[3]:
+                alias_names.append(alias)
+                alias_targets.append(tag_id)
+        return cls(
+            names=[row[0] for row in rows],
+            categories=array("B", (row[1] for row in rows)),
+            counts=array("I", (row[2] for row in rows)),
+            alias_names=alias_names,
+            alias_targets=alias_targets,
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+
+class CategoryIndex:
+    """
+    Per-category slice of a TagIndex.
+    positions holds, in ascending order, the positions in the global sorted
+    key list of the tags in this category, and ids the matching tag ids, so a
+    global prefix range maps to a category range with two binary searches.
+    The alias columns work the same way over the alias keys, and top_ids
+    holds this category's precomputed top-k for each short prefix.
+    """
+
+    def __init__(
+        self,
+        positions: Sequence[int],
+        ids: Sequence[int],
+        alias_positions: Sequence[int],
+        alias_ids: Sequence[int],
+        top_ids: Sequence[int],
+    ):
+        self.positions = positions
+        self.ids = ids
+        self.alias_positions = alias_positions
+        self.alias_ids = alias_ids
+        self.top_ids = top_ids
+
+    @classmethod
+    def empty(cls) -> "CategoryIndex":
+        return cls(array("I"), array("I"), array("I"), array("I"), array("I"))
+
+    def columns(self) -> dict[str, Sequence]:
+        """Returns the index columns, keyed like the constructor."""
+        return {
+            "positions": self.positions,
+            "ids": self.ids,
+            "alias_positions": self.alias_positions,
+            "alias_ids": self.alias_ids,
+            "top_ids": self.top_ids,
+        }
+
+    def candidates(
+        self, ranges: tuple[int, int, int, int]
+    ) -> tuple[Sequence[int], Sequence[int]]:
+        """Returns the tag and alias target ids of this category within ranges."""
+        lo, hi, alias_lo, alias_hi = ranges
+        start = bisect_left(self.positions, lo)
+        end = bisect_left(self.positions, hi, start)
+        alias_start = bisect_left(self.alias_positions, alias_lo)
+        alias_end = bisect_left(self.alias_positions, alias_hi, alias_start)
+        return self.ids[start:end], self.alias_ids[alias_start:alias_end]
+
+
+class TagIndex:
+    """
+    Prefix index over a TagStore.
+    Keeps the lowercased tags in a sorted list so a prefix lookup is two
+    binary searches instead of a scan over every tag. Aliases get their own
+    sorted key list pointing at canonical tag ids, so an alias prefix is
+    resolved by the same kind of lookup. Matches are ranked by popularity;
+    short prefixes, which match the most tags, have their top-k ids
+    precomputed. A TrigramIndex over the tag names backs the typo-tolerant
+    fuzzy_search(). Each category in TAG_CATEGORIES gets a CategoryIndex so
+    suggest() can restrict a query to some categories up front.
+
+    Use TagIndex.build() to index a store in memory; the constructor takes
+    prebuilt columns, e.g. from a memory-mapped tag database.
+    """
+
+    def __init__(
+        self,
+        store: TagStore,
+        keys: Sequence[str],
+        ids: Sequence[int],
+        alias_keys: Sequence[str],
+        alias_ids: Sequence[int],
+        top_keys: Sequence[str],
+        top_ids: Sequence[int],
+        fuzzy: TrigramIndex | None = None,
+        categories: dict[int, CategoryIndex] | None = None,
+    ):
+        self._store = store
+        self._keys = keys
+        self._ids = ids
+        self._alias_keys = alias_keys
+        self._alias_ids = alias_ids
+        # top_ids holds TOP_K ids per entry of top_keys, padded with NO_TAG
+        self._top_keys = top_keys
+        self._top_ids = top_ids
+        self._fuzzy = fuzzy
+        self._categories = categories or {}
+
+    @classmethod
+    def build(cls, store: TagStore) -> "TagIndex":
+        """Sorts the store's tags and aliases and precomputes short prefixes."""
+        pairs = sorted((name.lower(), i) for i, name in enumerate(store.names))
+        alias_pairs = sorted(
+            (alias.lower(), tag_id)
+            for alias, tag_id in zip(store.alias_names, store.alias_targets)
+        )
+        index = cls(
+            store,
+            keys=[key for key, _ in pairs],
+            ids=array("I", (i for _, i in pairs)),
+            alias_keys=[key for key, _ in alias_pairs],
+            alias_ids=array("I", (tag_id for _, tag_id in alias_pairs)),
+            top_keys=[],
+            top_ids=array("I"),
+            fuzzy=TrigramIndex.build(store.names),
+        )
+        index._build_category_indexes()
+        index._build_top_lists()
+        logger.info(
+            f"TagIndex built with {len(index._keys)} tags, "
+            f"{len(index._alias_keys)} aliases "
+            f"and {len(index._top_keys)} precomputed prefixes."
+        )
+        return index
+
+    @property
+    def store(self) -> TagStore:
+        return self._store
+
+    @property
+    def fuzzy(self) -> TrigramIndex | None:
+        return self._fuzzy
+
+    @property
+    def categories(self) -> dict[int, CategoryIndex]:
+        return self._categories
+
+    def columns(self) -> dict[str, Sequence]:
+        """Returns the index columns, keyed like the TagIndex constructor."""
+        return {
+            "keys": self._keys,
+            "ids": self._ids,
+            "alias_keys": self._alias_keys,
+            "alias_ids": self._alias_ids,
+            "top_keys": self._top_keys,
+            "top_ids": self._top_ids,
+        }
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _build_category_indexes(self):
+        tag_categories = self._store.categories
+        self._categories = {
+            category: CategoryIndex.empty() for category in TAG_CATEGORIES.values()
+        }
+        for position, tag_id in enumerate(self._ids):
+            category_index = self._categories.get(tag_categories[tag_id])
+            if category_index is not None:
+                category_index.positions.append(position)
+                category_index.ids.append(tag_id)
+        for position, tag_id in enumerate(self._alias_ids):
+            category_index = self._categories.get(tag_categories[tag_id])
+            if category_index is not None:
+                category_index.alias_positions.append(position)
+                category_index.alias_ids.append(tag_id)
+
+    def _build_top_lists(self):
+        prefixes = sorted(
+            {
+                key[:length]
+                for keys in (self._keys, self._alias_keys)
+                for key in keys
+                for length in range(1, TOP_PREFIX_LEN + 1)
+            }
+        )
+        top_ids = array("I")
+        for prefix in prefixes:
+            ranges = self.ranges(prefix)
+            self._append_top_list(top_ids, self._scan_top_ids(ranges, TOP_K))
+            for category, category_index in self._categories.items():
+                ids = self._scan_top_ids(ranges, TOP_K, (category,))
+                self._append_top_list(category_index.top_ids, ids)
+        self._top_keys = prefixes
+        self._top_ids = top_ids
+
+    @staticmethod
+    def _append_top_list(top_ids: array, ids: list[int]):
+        top_ids.extend(ids)
+        top_ids.extend([NO_TAG] * (TOP_K - len(ids)))
+
+    @staticmethod
+    def _range(
+        keys: Sequence[str], prefix: str, lo: int = 0, hi: int | None = None
+    ) -> tuple[int, int]:
+        if hi is None:
+            hi = len(keys)
+        lo = bisect_left(keys, prefix, lo, hi)
+        hi = bisect_left(keys, prefix + _PREFIX_END, lo, hi)
+        return lo, hi
+
+    def prefix_range(
+        self, prefix: str, lo: int = 0, hi: int | None = None
+    ) -> tuple[int, int]:
+        """Returns the [lo, hi) range of tag keys starting with the given prefix."""
+        return self._range(self._keys, prefix, lo, hi)
+
+    def alias_range(
+        self, prefix: str, lo: int = 0, hi: int | None = None
+    ) -> tuple[int, int]:
+        """Returns the [lo, hi) range of alias keys starting with the given prefix."""
+        return self._range(self._alias_keys, prefix, lo, hi)
+
+    def ranges(
+        self, prefix: str, within: tuple[int, int, int, int] | None = None
+    ) -> tuple[int, int, int, int]:
+        """
+        Returns the tag and alias key ranges (lo, hi, alias_lo, alias_hi)
+        matching the prefix. Passing the ranges of a shorter prefix of it as
+        `within` restricts the binary searches to those ranges.
+        """
+        if within is None:
+            within = (0, len(self._keys), 0, len(self._alias_keys))
+        lo, hi, alias_lo, alias_hi = within
+        return (
+            *self.prefix_range(prefix, lo, hi),
+            *self.alias_range(prefix, alias_lo, alias_hi),
+        )
+
+    @staticmethod
+    def _top_list(top_ids: Sequence[int], i: int) -> list[int]:
+        ids = top_ids[i * TOP_K : (i + 1) * TOP_K]
+        return [tag_id for tag_id in ids if tag_id != NO_TAG]
+
+    def _precomputed_top_ids(
+        self, prefix: str, k: int, categories: tuple[int, ...] | None = None
+    ) -> list[int] | None:
+        i = bisect_left(self._top_keys, prefix)
+        if i == len(self._top_keys) or self._top_keys[i] != prefix:
+            return None
+        if categories is None:
+            return self._top_list(self._top_ids, i)[:k]
+        # A tag belongs to exactly one category, so the merged lists hold no
+        # duplicates and their first k entries are the overall top k
+        lists = [
+            self._top_list(self._categories[category].top_ids, i)
+            for category in categories
+            if category in self._categories
+        ]
+        return list(islice(heapq.merge(*lists), k))
+
+    def _scan_top_ids(
+        self,
+        ranges: tuple[int, int, int, int],
+        k: int,
+        categories: tuple[int, ...] | None = None,
+    ) -> list[int]:
+        lo, hi, alias_lo, alias_hi = ranges
+        if categories is not None:
+            candidates = set()
+            for category in categories:
+                category_index = self._categories.get(category)
+                if category_index is not None:
+                    ids, alias_ids = category_index.candidates(ranges)
+                    candidates.update(ids)
+                    candidates.update(alias_ids)
+        elif alias_lo == alias_hi:
+            candidates = self._ids[lo:hi]
+        else:
+            # A tag and its aliases can share the prefix; count each tag once
+            candidates = set(self._ids[lo:hi])
+            candidates.update(self._alias_ids[alias_lo:alias_hi])
+        if len(candidates) <= k:
+            return sorted(candidates)
+        return heapq.nsmallest(k, candidates)
+
+    @staticmethod
+    def category_ids(categories) -> tuple[int, ...] | None:
+        """Normalizes category names or numbers to a tuple of category numbers."""
+        if categories is None:
+            return None
+        return tuple(
+            TAG_CATEGORIES[c] if isinstance(c, str) else int(c) for c in categories
+        )
+
+    def top_ids(
+        self,
+        prefix: str,
+        k: int = TOP_K,
+        ranges: tuple[int, int, int, int] | None = None,
+        categories=None,
+    ) -> list[int]:
+        """
+        Returns the ids of the k most popular tags whose name or one of whose
+        aliases starts with the prefix, optionally only from the given
+        categories (names or numbers). `ranges` may pass the prefix's
+        already computed key ranges to skip the lookup.
+        """
+        categories = self.category_ids(categories)
+        if k <= TOP_K and len(prefix) <= TOP_PREFIX_LEN:
+            ids = self._precomputed_top_ids(prefix, k, categories)
+            if ids is not None:
+                return ids
+        if ranges is None:
+            ranges = self.ranges(prefix)
+        return self._scan_top_ids(ranges, k, categories)
+
+    def suggest(self, prefix: str, categories=None, k: int = TOP_K) -> list[str]:
+        """
+        Returns up to k tags starting with the prefix, most popular first.
+        categories limits the result to some categories, e.g.
+        ("artist", "character"); None means every category.
+        """
+        prefix = prefix.lower()
+        if not prefix:
+            return []
+        names = self._store.names
+        return [names[i] for i in self.top_ids(prefix, k, categories=categories)]
+
+    def search(self, prefix: str, limit: int = TOP_K) -> list[str]:
+        """Returns up to `limit` tags starting with the prefix, most popular first."""
+        return self.suggest(prefix, k=limit)
+
+    def fuzzy_search(self, word: str, limit: int = TOP_K, categories=None) -> list[str]:
+        """
+        Returns up to `limit` tags within a few typos of the word, closest
+        first. Meant as a fallback when search() finds nothing.
+        """
+        if self._fuzzy is None:
+            return []
+        categories = self.category_ids(categories)
+        accept = None
+        if categories is not None:
+            tag_categories = self._store.categories
+
+            def accept(tag_id):
+                return tag_categories[tag_id] in categories
+
+        ids = self._fuzzy.search_ids(word, limit, accept)
+        names = self._store.names
+        return [names[i] for i in ids]
@@ -0,0 +1,110 @@
+# src/utils/workflow_bindings.py
+from typing import Any, NamedTuple, Sequence
+
+
+class Binding(NamedTuple):
+    """
+    Maps a settings field (or a constant value) to one input of a workflow
+    node. node is matched against node ids, then "_meta" titles, then class
+    types, and must select exactly one node of the template.
+    """
+
+    node: str
+    input: str
+    field: str | None = None  # Key in the source settings; None for value
+    source: str = "setting"  # Which settings dict the field is read from
+    value: Any = None  # Constant written when field is None
+    when: str | None = None  # Only applied if this source is given
+
+
+# Bindings for GGUF_WORKFLOW_API.json and variants with the same node types
+GGUF_BINDINGS = (
+    Binding("UnetLoaderGGUFAdvanced", "unet_name", "model"),
+    Binding("Positive", "text", "positive_prompt"),
+    Binding("KSampler", "seed", "seed"),
+    Binding("KSampler", "steps", "steps"),
+    Binding("KSampler", "cfg", "cfg"),
+    Binding("KSampler", "sampler_name", "sampler_name"),
+    Binding("KSampler", "scheduler", "scheduler"),
+    # Note: "preview_image" should be a string "enable" not a boolean
+    Binding("KSampler", "preview_image", value="enable"),
+    Binding("EmptyLatentImage", "width", "width"),
+    Binding("EmptyLatentImage", "height", "height"),
+    Binding("EmptyLatentImage", "batch_size", "batch_size"),
+    # The ImpactInversedSwitch expects 1-indexed values (1 or 2) from the setting.
+    Binding("ImpactInversedSwitch", "select", "Face_detailer_switch"),
+    Binding("FaceDetailer", "steps", "steps", source="face_detailer"),
+    Binding("FaceDetailer", "cfg", "cfg", source="face_detailer"),
+    Binding("FaceDetailer", "sampler_name", "sampler_name", source="face_detailer"),
+    Binding("FaceDetailer", "scheduler", "scheduler", source="face_detailer"),
+    Binding("FaceDetailer", "denoise", "denoise", source="face_detailer"),
+    Binding("FaceDetailer", "bbox_threshold", "bbox_threshold", source="face_detailer"),
+    Binding(
+        "FaceDetailer", "bbox_crop_factor", "bbox_crop_factor", source="face_detailer"
+    ),
+    # Use the main seed for the face detailer as well
+    Binding("FaceDetailer", "seed", "seed", when="face_detailer"),
+)
+
+
+def resolve_node(nodes: dict, selector: str) -> str:
+    """Returns the id of the one node matching selector."""
+    if selector in nodes:
+        return selector
+    for key in (
+        lambda node: node.get("_meta", {}).get("title"),
+        lambda node: node.get("class_type"),
+    ):
+        matches = [node_id for node_id, node in nodes.items() if key(node) == selector]
+        if len(matches) == 1:
+            return matches[0]
+        if matches:
+            raise ValueError(
+                f"Binding node '{selector}' is ambiguous: nodes {', '.join(matches)}"
+            )
+    raise ValueError(f"Binding node '{selector}' not found in the workflow")
+
+
+class PatchPlan:
+    """
+    Bindings resolved against one template. patches() turns settings into
+    the {node id: {input: value}} overrides for WorkflowTemplate without
+    searching the workflow again.
+    """
+
+    def __init__(self, constants: dict[str, dict], groups: list[tuple]):
+        self._constants = constants
+        # (source, when, [(field, node_id, input), ...])
+        self._groups = groups
+
+    @classmethod
+    def compile(cls, nodes: dict, bindings: Sequence[Binding]) -> "PatchPlan":
+        constants: dict[str, dict] = {}
+        groups: dict[tuple, list] = {}
+        for binding in bindings:
+            node_id = resolve_node(nodes, binding.node)
+            if binding.field is None:
+                constants.setdefault(node_id, {})[binding.input] = binding.value
+            else:
+                steps = groups.setdefault((binding.source, binding.when), [])
+                steps.append((binding.field, node_id, binding.input))
+        return cls(
+            constants,
+            [(source, when, steps) for (source, when), steps in groups.items()],
+        )
+
+    def patches(self, sources: dict[str, dict | None]) -> dict[str, dict]:
+        """
+        Returns the input overrides for sources, a mapping of source name to
+        settings dict. Fields missing from a settings dict keep the template
+        value, and sources that are None are skipped.
+        """
+        patches = {node_id: dict(inputs) for node_id, inputs in self._constants.items()}
+        for source, when, steps in self._groups:
+            values = sources.get(source)
+            if not values or (when is not None and not sources.get(when)):
+                continue
+            for field, node_id, input_name in steps:
+                if field in values:
+                    patches.setdefault(node_id, {})[input_name] = values[field]
+        return patches
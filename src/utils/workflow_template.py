@@ -0,0 +1,84 @@
+# src/utils/workflow_template.py
+import json
+import os
+import threading
+import time
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class WorkflowTemplate:
+    """
+    A ComfyUI API workflow parsed once and shared by every job.
+
+    The file is re-parsed only when its size or mtime changes, checked at
+    most once per check_interval seconds. instantiate() builds a job's
+    workflow as a new top-level dict that shares the template's node dicts
+    and copies only the nodes it patches, so a job costs a handful of small
+    dict copies instead of a json.load or a deep copy. Shared nodes must
+    therefore be treated as read-only: replace a node in the job's workflow
+    instead of mutating it.
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._nodes = None
+        self._signature = None
+        self._checked_at = 0.0
+        self.version = 0  # Incremented every time the file is (re)loaded
+
+    def _file_signature(self) -> tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if self._nodes is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            signature = self._file_signature()
+            if signature == self._signature:
+                return
+            with open(self.path, "r") as f:
+                nodes = json.load(f)
+        except (OSError, ValueError) as e:
+            if self._nodes is None:
+                raise
+            # The file may be mid-save; keep serving the previous version
+            logger.error(f"Could not reload workflow template {self.path}: {e}")
+            return
+        self._nodes, self._signature = nodes, signature
+        self.version += 1
+        logger.info(f"Loaded workflow template {self.path} (version {self.version}).")
+
+    def nodes(self) -> dict:
+        """Returns the parsed template, reloading it if the file changed."""
+        with self._lock:
+            self._reload_if_changed()
+            return self._nodes
+
+    def snapshot(self) -> tuple[int, dict]:
+        """Returns the current version and parsed template together."""
+        with self._lock:
+            self._reload_if_changed()
+            return self.version, self._nodes
+
+    def instantiate(self, patches: dict[str, dict] | None = None) -> dict:
+        """
+        Returns a workflow for one job: the template with patches, a mapping
+        of node id to {input name: value}, applied to copies of those nodes.
+        """
+        return apply_patches(self.nodes(), patches)
+
+
+def apply_patches(nodes: dict, patches: dict[str, dict] | None) -> dict:
+    """Copies nodes, sharing every node that patches does not touch."""
+    workflow = dict(nodes)
+    for node_id, inputs in (patches or {}).items():
+        node = nodes[node_id]
+        workflow[node_id] = {**node, "inputs": {**node["inputs"], **inputs}}
+    return workflow
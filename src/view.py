@@ -2,7 +2,7 @@
 import flet as ft
 import threading
 from utils.logger import get_logger, set_flet_logging, set_default_logging
-from utils.data import IMAGE_SRC
+from utils.data import IMAGE_SRC, RESULT_CACHE_DIR
 from components.status_indicator import StatusIndicator
 from components.connection_indicator import ConnectionIndicator
 from components.setting_panel import SettingsPanel
@@ -11,6 +11,7 @@ from services.generation_services import (
     GenerationService,
 )
 from services.client import ComfyUIClient
+from services.result_cache import open_result_cache
 from services.config_service import ConfigService
 import base64
 from PIL import Image
@@ -40,6 +41,7 @@ class HomeView(ft.Stack):
             on_status_update=self.update_status_widget,
             on_image_update=self.update_image,
             on_preview_update=self.update_preview,
+            result_cache=open_result_cache(RESULT_CACHE_DIR),
         )
 
         # --- 2. Initialize Components ---
@@ -200,16 +202,12 @@ class HomeView(ft.Stack):
         finally:
             self._is_connecting = False
 
-    def update_image(self, image_b64: str):
+    def update_image(self, image_bytes: bytes):
         logger.info("Updating main image.")
-        # Inside the update_image(self, image_b64: str) method:
-        # 1. Decode the base64 string to binary
-        image_bytes = base64.b64decode(image_b64)
-
-        # 2. Open the image using Pillow
+        # 1. Open the downloaded image bytes using Pillow
         img = Image.open(io.BytesIO(image_bytes))
 
-        # 3. Check if rotation is needed and rotate the image object
+        # 2. Check if rotation is needed and rotate the image object
         config = self.config_service.load_config()
 
         current_height = config["generation_setting"]["height"]
@@ -219,29 +217,25 @@ class HomeView(ft.Stack):
             logger.debug("Rotating image -90 degrees.")
             img = img.rotate(-90, expand=True)
 
-        # 4. Save the potentially rotated image to a new byte buffer
+        # 3. Save the potentially rotated image to a new byte buffer
         output_buffer = io.BytesIO()
         img.save(output_buffer, format="PNG")
 
-        # 5. Get the new base64 string
+        # 4. Get the new base64 string
         new_image_b64 = base64.b64encode(output_buffer.getvalue()).decode("utf-8")
 
-        # 6. Update the UI control with the new image and its correct dimensions
+        # 5. Update the UI control with the new image and its correct dimensions
         self.background_image.rotate = None  # Ensure no framework rotation is applied
         self.background_image.src_base64 = new_image_b64
         self.background_image.update()
         logger.info("Main image updated successfully.")
 
-    def update_preview(self, image_b64: str):
+    def update_preview(self, image_bytes: bytes):
         logger.info("Updating preview image.")
-        # Inside the update_image(self, image_b64: str) method:
-        # 1. Decode the base64 string to binary
-        image_bytes = base64.b64decode(image_b64)
-
-        # 2. Open the image using Pillow
+        # 1. Open the preview image bytes using Pillow
         img = Image.open(io.BytesIO(image_bytes))
 
-        # 3. Check if rotation is needed and rotate the image object
+        # 2. Check if rotation is needed and rotate the image object
         config = self.config_service.load_config()
 
         current_height = config["generation_setting"]["height"]
@@ -251,14 +245,14 @@ class HomeView(ft.Stack):
             logger.debug("Rotating preview image -90 degrees.")
             img = img.rotate(-90, expand=True)
 
-        # 4. Save the potentially rotated image to a new byte buffer
+        # 3. Save the potentially rotated image to a new byte buffer
         output_buffer = io.BytesIO()
         img.save(output_buffer, format="PNG")
 
-        # 5. Get the new base64 string
+        # 4. Get the new base64 string
         new_image_b64 = base64.b64encode(output_buffer.getvalue()).decode("utf-8")
 
-        # 6. Update the UI control with the new image and its correct dimensions
+        # 5. Update the UI control with the new image and its correct dimensions
         self.background_image.rotate = None  # Ensure no framework rotation is applied
         self.background_image.src_base64 = new_image_b64
         self.background_image.update()
@@ -298,8 +292,8 @@ class HomeView(ft.Stack):
         logger.debug(f"Updating status widget: {action} - {status}")
         self.status_widget.update_status(action, status, ac_color, st_color)
 
-        is_generating = action in ["Queuing...", "Generating...", "Downloading..."]
-        self.input_bar.set_input_enabled(not is_generating)
+        # Prompts can be queued while others generate; only block while sending
+        self.input_bar.set_input_enabled(action != "Queuing...")
 
         if action == "Generating...":
             self.close_overlays(None)